@@ -0,0 +1,282 @@
+import functools
+import json
+import os
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import crud, models
+
+# Archived and settled groups keep their files in SQLite but move their
+# transactions out of the hot table into one compressed Arrow IPC file per
+# group. Each file's rows are stored as consecutive record batches and the
+# footer metadata maps file ids to those batches and the range of ids they
+# hold, so reading a file or finding a transaction in a memory-mapped
+# archive only decompresses the batches that can hold it.
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_COMPRESSION = os.getenv("ARCHIVE_COMPRESSION", "zstd")
+ARCHIVE_BATCH_ROWS = 65536
+
+# Field order of schemas.Transaction, as served by the list endpoints
+TRANSACTION_FIELDS = (
+    'date', 'description', 'amount', 'action', 'owner', 'previous_action', 'file_id', 'id', 'suggested_action'
+)
+STORED_FIELDS = TRANSACTION_FIELDS + ('iso_date', 'fingerprint', 'rev')
+
+
+class RestoreConflict(Exception):
+    pass
+
+
+def arrow_schema(fields=STORED_FIELDS, metadata=None):
+    import pyarrow as pa
+
+    schema = pa.schema([
+        ('date', pa.string()),
+        ('description', pa.string()),
+        ('amount', pa.float64()),
+        ('action', pa.string()),
+        ('owner', pa.string()),
+        ('previous_action', pa.string()),
+        ('file_id', pa.int64()),
+        ('id', pa.int64()),
+        ('suggested_action', pa.string()),
+        ('iso_date', pa.string()),
+        ('fingerprint', pa.string()),
+        ('rev', pa.int64()),
+    ])
+    return pa.schema([schema.field(name) for name in fields], metadata=metadata)
+
+
+def archive_path(group_id: int):
+    return os.path.join(ARCHIVE_DIR, f"group_{group_id}.arrow")
+
+
+def update_group(db: Session, group_id: int, **fields):
+    # crud.update_group, moving the group's transactions to the tier its
+    # archived/settled flags call for in the same transaction
+    db_group = crud.get_group(db, group_id=group_id)
+    if db_group is None:
+        return None
+    flags = {'is_archived': db_group.is_archived, 'is_settled': db_group.is_settled, **fields}
+    cold = bool(flags['is_archived'] or flags['is_settled'])
+    if cold and not db_group.cold_storage:
+        freeze_transactions(db, group_id)
+    elif not cold and db_group.cold_storage:
+        thaw_transactions(db, group_id)
+    return crud.update_group(db, group_id, cold_storage=cold, **fields)
+
+
+def freeze_transactions(db: Session, group_id: int):
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+
+    Transaction = models.Transaction
+    file_ids = select(models.File.id).where(models.File.group_id == group_id)
+    counts = db.execute(
+        select(Transaction.file_id, func.count(), func.min(Transaction.id), func.max(Transaction.id))
+        .where(Transaction.file_id.in_(file_ids))
+        .group_by(Transaction.file_id)
+        .order_by(Transaction.file_id)
+    ).all()
+
+    # The batch layout follows from the row counts, so the index can go in
+    # the schema before any batch is written
+    index, first = {}, 0
+    for file_id, count, min_id, max_id in counts:
+        batches = -(-count // ARCHIVE_BATCH_ROWS)
+        index[str(file_id)] = [first, batches, min_id, max_id]
+        first += batches
+    schema = arrow_schema(metadata={b'files': json.dumps(index).encode()})
+
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = archive_path(group_id)
+    options = ipc.IpcWriteOptions(compression=ARCHIVE_COMPRESSION or None)
+    with open(path + ".tmp", "wb") as sink:
+        with ipc.new_file(sink, schema, options=options) as writer:
+            query = (
+                select(*(getattr(Transaction, name) for name in STORED_FIELDS))
+                .order_by(Transaction.id)
+                .limit(ARCHIVE_BATCH_ROWS)
+            )
+            for file_id, *_ in counts:
+                after_id = 0
+                while True:
+                    batch = db.execute(query.where(Transaction.file_id == file_id, Transaction.id > after_id)).all()
+                    if not batch:
+                        break
+                    writer.write_batch(pa.RecordBatch.from_pylist([row._asdict() for row in batch], schema=schema))
+                    after_id = batch[-1].id
+        sink.flush()
+        os.fsync(sink.fileno())
+    os.replace(path + ".tmp", path)
+
+    crud.unindex_descriptions(db, Transaction.file_id.in_(file_ids))
+    db.execute(delete(Transaction).where(Transaction.file_id.in_(file_ids)))
+
+
+def thaw_transactions(db: Session, group_id: int):
+    # The archive file itself is removed by remove_archive once this commits
+    reader = _open(group_id)
+    if reader is None:
+        return
+    for i in range(reader.num_record_batches):
+        rows = reader.get_batch(i).to_pylist()
+        try:
+            db.execute(insert(models.Transaction), rows)
+        except IntegrityError:
+            # Only possible for archives written while ids could still be
+            # reused, before transactions ids were AUTOINCREMENT
+            raise RestoreConflict(f"Archived transactions of group {group_id} clash with ids now in use")
+        crud.index_descriptions(db, [(row['id'], row['description']) for row in rows])
+
+
+def remove_archive(group_id: int):
+    try:
+        os.remove(archive_path(group_id))
+    except FileNotFoundError:
+        pass
+
+
+def _open(group_id: int):
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+
+    try:
+        return ipc.open_file(pa.memory_map(archive_path(group_id)))
+    except FileNotFoundError:
+        return None
+
+
+def max_id(group_id: int):
+    # Highest transaction id in the group's archive, None if there is none
+    import pyarrow.compute as pc
+
+    reader = _open(group_id)
+    ids = [pc.max(reader.get_batch(i).column('id')).as_py() for i in range(reader.num_record_batches if reader else 0)]
+    return max((i for i in ids if i is not None), default=None)
+
+
+def _file_batches(reader, file_id: int):
+    index = json.loads(reader.schema.metadata[b'files'])
+    first, count = index.get(str(file_id), (0, 0))[:2]
+    for i in range(first, first + count):
+        yield reader.get_batch(i)
+
+
+def _columns(batch, names):
+    # Column values as lists; archives written before a field was added
+    # read it as NULL
+    return [
+        batch.column(name).to_pylist() if name in batch.schema.names else [None] * batch.num_rows
+        for name in names
+    ]
+
+
+def iter_transaction_batches(group_id: int, file_id: int):
+    # Archived counterpart of crud.iter_transaction_batches, as lists of dicts
+    reader = _open(group_id)
+    if reader is None:
+        return
+    for batch in _file_batches(reader, file_id):
+        yield [dict(zip(TRANSACTION_FIELDS, row)) for row in zip(*_columns(batch, TRANSACTION_FIELDS))]
+
+
+def iter_group_batches(group_id: int, date_from: str = None, date_to: str = None, actions=None):
+    # Archived counterpart of crud.iter_group_transaction_batches with the
+    # same filters, as lists of row tuples in TRANSACTION_FIELDS order
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    reader = _open(group_id)
+    for i in range(reader.num_record_batches if reader else 0):
+        batch = reader.get_batch(i)
+        conditions = []
+        if date_from is not None:
+            conditions.append(pc.greater_equal(batch.column('iso_date'), date_from))
+        if date_to is not None:
+            conditions.append(pc.less_equal(batch.column('iso_date'), date_to))
+        if actions:
+            conditions.append(pc.is_in(batch.column('action'), value_set=pa.array(actions, pa.string())))
+        if conditions:
+            batch = batch.filter(functools.reduce(pc.and_, conditions))
+        if batch.num_rows:
+            yield list(zip(*_columns(batch, TRANSACTION_FIELDS)))
+
+
+def iter_changed_rows(group_id: int, since: int, after_id: int = None):
+    # Archived counterpart of the transactions sync.changes reads: row tuples
+    # in TRANSACTION_FIELDS order followed by the revision, for rows after the
+    # (revision, id) cursor. Archives without revisions hold revision 1.
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    reader = _open(group_id)
+    for i in range(reader.num_record_batches if reader else 0):
+        batch = reader.get_batch(i)
+        revs = batch.column('rev') if 'rev' in batch.schema.names else pa.nulls(batch.num_rows, pa.int64())
+        revs = pc.fill_null(revs, 1)
+        after = pc.greater(revs, since)
+        if after_id is not None:
+            after = pc.or_(after, pc.and_(pc.equal(revs, since), pc.greater(batch.column('id'), after_id)))
+        batch, revs = batch.filter(after), revs.filter(after)
+        if batch.num_rows:
+            yield [(*row, rev) for row, rev in zip(zip(*_columns(batch, TRANSACTION_FIELDS)), revs.to_pylist())]
+
+
+def get_transaction_rows(group_id: int, file_id: int, after_id: int = None, limit: int = None):
+    # Archived counterpart of crud.get_transaction_rows: keys and row tuples
+    # in the field order of schemas.Transaction, in id order
+    import pyarrow.compute as pc
+
+    rows = []
+    reader = _open(group_id)
+    for batch in _file_batches(reader, file_id) if reader else ():
+        if after_id is not None:
+            batch = batch.filter(pc.greater(batch.column('id'), after_id))
+        rows.extend(zip(*_columns(batch, TRANSACTION_FIELDS)))
+        if limit is not None and len(rows) >= limit:
+            break
+    return TRANSACTION_FIELDS, rows[:limit] if limit is not None else rows
+
+
+@functools.lru_cache(maxsize=1024)
+def _id_ranges(group_id: int, rev: int):
+    # (min id, max id, first batch, batches) per file of the group's archive.
+    # Keyed by the group's revision, which moves whenever its archive is
+    # written or removed. Archives written before the ranges were recorded
+    # get them from their id columns.
+    import pyarrow.compute as pc
+
+    reader = _open(group_id)
+    if reader is None:
+        return ()
+    ranges = []
+    for first, count, *bounds in json.loads(reader.schema.metadata[b'files']).values():
+        if not bounds:
+            ids = [pc.min_max(reader.get_batch(i).column('id')) for i in range(first, first + count)]
+            bounds = [min(i['min'].as_py() for i in ids), max(i['max'].as_py() for i in ids)]
+        ranges.append((*bounds, first, count))
+    return tuple(ranges)
+
+
+def find_transaction(db: Session, transaction_id: int):
+    # Looks for a single transaction in the archives of cold groups, reading
+    # only the batches of files whose id range covers it
+    import pyarrow.compute as pc
+
+    groups = db.execute(
+        select(models.UserGroup.id, models.UserGroup.rev).where(models.UserGroup.cold_storage == True)
+    ).all()
+    for group_id, rev in groups:
+        for min_id, max_id, first, count in _id_ranges(group_id, rev):
+            if not min_id <= transaction_id <= max_id:
+                continue
+            reader = _open(group_id)
+            for i in range(first, first + count):
+                batch = reader.get_batch(i)
+                match = batch.filter(pc.equal(batch.column('id'), transaction_id))
+                if match.num_rows:
+                    return dict(zip(TRANSACTION_FIELDS, next(zip(*_columns(match, TRANSACTION_FIELDS)))))
+    return None
@@ -0,0 +1,69 @@
+import numpy as np
+
+# Share of a transaction's amount carried by (person1, person2) for each
+# action. An action naming one of the group's members puts the whole amount
+# on that member; anything not listed (e.g. 'Ignore') counts for nobody.
+ACTION_SHARES = {
+    'Split': (0.5, 0.5),
+    'Ignore': (0.0, 0.0),
+}
+
+
+def action_shares(person1: str, person2: str):
+    shares = dict(ACTION_SHARES)
+    if person1:
+        shares[person1] = (1.0, 0.0)
+    if person2:
+        shares[person2] = (0.0, 1.0)
+    return shares
+
+
+def share_columns(actions, shares):
+    # Map an array of actions to two arrays of shares with a single lookup
+    # per distinct action
+    if not len(actions):
+        return np.zeros(0), np.zeros(0)
+    labels, inverse = np.unique(np.array(actions, dtype=object).astype(str), return_inverse=True)
+    table = np.array([shares.get(label, (0.0, 0.0)) for label in labels], dtype=float)
+    return table[inverse, 0], table[inverse, 1]
+
+
+def compute_balances(amounts, actions, shares):
+    amounts = np.nan_to_num(np.asarray(amounts, dtype=float))
+    share_person1, share_person2 = share_columns(actions, shares)
+    return float(amounts @ share_person1), float(amounts @ share_person2)
+
+
+def balance_deltas(amounts, old_actions, new_actions, shares):
+    # Change in both balances when the given rows move from their old to
+    # their new action; inserted rows have no old action
+    amounts = np.nan_to_num(np.asarray(amounts, dtype=float))
+    old_person1, old_person2 = share_columns(old_actions, shares)
+    new_person1, new_person2 = share_columns(new_actions, shares)
+    return float(amounts @ (new_person1 - old_person1)), float(amounts @ (new_person2 - old_person2))
+
+
+def net_balances(owners, actions, amounts, members):
+    # What each member is owed (positive) or owes (negative), from amounts
+    # totalled per (payer, action): 'Split' puts an even share on every
+    # member, a member's name puts the whole amount on them, and the payer
+    # is owed whatever was put on the others. Charges are negative on
+    # statements; rows paid by non-members or with other actions count for
+    # nobody.
+    count = len(members)
+    index = {member: i for i, member in enumerate(members)}
+    actions = list(actions)
+    payers = np.array([index.get(owner, -1) for owner in owners], dtype=int)
+    spent = -np.nan_to_num(np.asarray(amounts, dtype=float))
+    split = np.array([action == 'Split' for action in actions], dtype=bool)
+    assigned = np.array([-1 if action == 'Split' else index.get(action, -1) for action in actions], dtype=int)
+
+    counted = (payers >= 0) & (split | (assigned >= 0))
+    # Float from the start: bincount of an empty selection is integer
+    nets = np.zeros(count)
+    nets += np.bincount(payers[counted], weights=spent[counted], minlength=count)
+    if count:
+        nets -= spent[counted & split].sum() / count
+    own = counted & (assigned >= 0)
+    nets -= np.bincount(assigned[own], weights=spent[own], minlength=count)
+    return nets
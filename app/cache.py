@@ -0,0 +1,75 @@
+import functools
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import orjson
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+
+from . import metrics
+
+# LRU of serialized read responses keyed by URL and the revision of what
+# they show: the group or file's own `rev`, which every write to it (or,
+# for a group, to any of its files) moves, or the global sync revision for
+# lists spanning every group. Revisions live in the database, so every
+# process serving it agrees on ETags and none keeps serving a response
+# another has since changed; a write leaves other groups' responses cached.
+READ_CACHE_SIZE = int(os.getenv("READ_CACHE_SIZE", "1024"))
+
+_responses = OrderedDict()
+_lock = threading.Lock()
+
+
+def etag(request: Request, rev: int):
+    url = hashlib.blake2b(str(request.url.path + "?" + request.url.query).encode(), digest_size=8).hexdigest()
+    return f'W/"{url}-{rev}"'
+
+
+def cached_response(request: Request, rev: int, build):
+    # `build` runs only on a cache miss and returns (content, headers).
+    # Callers read `rev` before building, so a response can only be newer
+    # than its tag, never older.
+    tag = etag(request, rev)
+    if tag in request.headers.get("if-none-match", ""):
+        metrics.READ_CACHE.inc(result="not_modified")
+        return Response(status_code=304, headers={"ETag": tag})
+
+    with _lock:
+        cached = _responses.get(tag)
+        if cached is not None:
+            _responses.move_to_end(tag)
+
+    metrics.READ_CACHE.inc(result="miss" if cached is None else "hit")
+    if cached is None:
+        cached = build()
+        with _lock:
+            _responses[tag] = cached
+            while len(_responses) > READ_CACHE_SIZE:
+                _responses.popitem(last=False)
+
+    content, headers = cached
+    return Response(content=content, media_type="application/json", headers={**headers, "ETag": tag})
+
+
+def clear():
+    with _lock:
+        _responses.clear()
+
+
+@functools.lru_cache(maxsize=None)
+def _adapter(model_type):
+    return TypeAdapter(model_type)
+
+
+def encode(model_type, value) -> bytes:
+    adapter = _adapter(model_type)
+    return adapter.dump_json(adapter.validate_python(value, from_attributes=True))
+
+
+def encode_rows(keys, rows) -> bytes:
+    # Fast path for list endpoints: Core rows selected in the schema's field
+    # order go straight to orjson, skipping per-row model validation
+    keys = list(keys)
+    return orjson.dumps([dict(zip(keys, row)) for row in rows])
@@ -1,34 +1,253 @@
+import hashlib
+import re
+import string
+from sqlalchemy import Float, Integer, String, and_, bindparam, cast, column, delete, func, insert, literal, or_, select, text, tuple_, update, values
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
-from . import models, schemas
+from . import balances, formats, merchants, models, schemas
 from typing import List
+from collections import Counter
+from itertools import islice
 
 def get_file(db: Session, file_id: int):
     return db.query(models.File).filter(models.File.id == file_id).first()
 
 
+def get_file_by_content_hash(db: Session, group_id: int, owner: str, content_hash: str):
+    return db.query(models.File).filter(
+        models.File.group_id == group_id,
+        models.File.content_hash == content_hash,
+        models.File.owner == owner
+    ).first()
+
+def count_file_transactions(db: Session, file_id: int):
+    return db.scalar(select(func.count()).where(models.Transaction.file_id == file_id))
+
 def get_files_by_group_id(db: Session, group_id: int):
     return db.query(models.File).filter(models.File.group_id == group_id).all()
 
+def get_file_rows(db: Session, group_id: int):
+    # Plain rows in the field order of schemas.File, for the fast list path
+    File = models.File
+    return db.execute(
+        select(File.name, File.group_id, File.owner, File.balance_person1, File.balance_person2, File.id)
+        .where(File.group_id == group_id)
+    )
+
 def get_transactions_by_file_id(db: Session, file_id: int):
     return db.query(models.Transaction).filter(models.Transaction.file_id == file_id).all()
 
+def get_transactions_page(db: Session, file_id: int, after_id: int = None, limit: int = 100):
+    # Keyset pagination on the primary key
+    query = db.query(models.Transaction).filter(models.Transaction.file_id == file_id)
+    if after_id is not None:
+        query = query.filter(models.Transaction.id > after_id)
+    return query.order_by(models.Transaction.id).limit(limit).all()
+
+def _transaction_columns():
+    # Plain rows in the field order of schemas.Transaction. The amount column
+    # is declared Integer, so SQLite hands back whole amounts as ints; cast to
+    # REAL to match the float the schema would have produced.
+    Transaction = models.Transaction
+    return (
+        Transaction.date, Transaction.description, cast(Transaction.amount, Float).label('amount'),
+        Transaction.action, Transaction.owner, Transaction.previous_action, Transaction.file_id, Transaction.id,
+        Transaction.suggested_action
+    )
+
+def _transaction_rows_query(file_id: int):
+    return (
+        select(*_transaction_columns())
+        .where(models.Transaction.file_id == file_id)
+        .order_by(models.Transaction.id)
+    )
+
+def get_transaction_rows(db: Session, file_id: int, after_id: int = None, limit: int = None):
+    # Same rows as get_transactions_by_file_id / get_transactions_page
+    # without building ORM objects
+    query = _transaction_rows_query(file_id)
+    if after_id is not None:
+        query = query.where(models.Transaction.id > after_id)
+    if limit is not None:
+        query = query.limit(limit)
+    return db.execute(query)
+
+def iter_transaction_batches(db: Session, file_id: int, batch_size: int = 1000, filters=()):
+    # Plain rows in id order, one short keyset query per batch so no read
+    # is held open while the caller is busy with the previous batch
+    Transaction = models.Transaction
+    query = _transaction_rows_query(file_id).where(*filters).limit(batch_size)
+    after_id = None
+    while True:
+        batch = db.execute(query if after_id is None else query.where(Transaction.id > after_id)).all()
+        if not batch:
+            return
+        yield batch
+        after_id = batch[-1].id
+
+def transaction_filters(date_from: str = None, date_to: str = None, actions: List[str] = None):
+    # Optional export filters; dates compare against the sortable iso_date
+    Transaction = models.Transaction
+    filters = []
+    if date_from is not None:
+        filters.append(Transaction.iso_date >= date_from)
+    if date_to is not None:
+        filters.append(Transaction.iso_date <= date_to)
+    if actions:
+        filters.append(Transaction.action.in_(actions))
+    return filters
+
+def iter_group_transaction_batches(db: Session, group_id: int, batch_size: int = 5000, filters=()):
+    # Every transaction of a group, file by file and in id order within a
+    # file, so each batch is a keyset read on the file_id index
+    file_ids = db.scalars(
+        select(models.File.id).where(models.File.group_id == group_id).order_by(models.File.id)
+    ).all()
+    for file_id in file_ids:
+        yield from iter_transaction_batches(db, file_id=file_id, batch_size=batch_size, filters=filters)
+
 
 def create_file(db: Session, file: schemas.FileCreate):
     db_file = models.File(
         name=file.name,
         group_id=file.group_id,
-        owner=file.owner  # Save the owner field
+        owner=file.owner,  # Save the owner field
+        rev=next_revision(db)
     )
     db.add(db_file)
+    _stamp_revision(db, db_file.rev, group_ids=[file.group_id])
     db.commit()
     db.refresh(db_file)
     return db_file
 
+def fingerprint_key(group_id: int, iso_date: str, description: str, amount, owner: str):
+    return (group_id, iso_date, normalize_description(description or ''), formats.to_cents(amount), owner)
+
+def row_fingerprint(key, occurrence: int):
+    # The nth identical charge (same key) of a group. Counting occurrences
+    # keeps real repeated charges apart while an overlapping export of the
+    # same charges maps onto the rows stored before.
+    return hashlib.blake2b("\x1f".join(map(str, (*key, occurrence))).encode(), digest_size=16).hexdigest()
+
+def create_file_with_transactions(db: Session, file: schemas.FileCreate, rows, batch_size: int = 5000,
+                                  on_progress=None, on_duplicate=None):
+    # Insert the file and all of its rows in one transaction so a failure
+    # part way through does not leave an orphan file with partial rows.
+    # `rows` is any iterable of (date, description, amount) tuples and is
+    # consumed in fixed-size batches. Rows the group already holds (by
+    # fingerprint) are skipped and reported through on_duplicate; the rest
+    # get the action the owner's merchant index suggests.
+    try:
+        rev = next_revision(db)
+        db_file = models.File(
+            name=file.name,
+            group_id=file.group_id,
+            owner=file.owner,
+            content_hash=file.content_hash,
+            rev=rev
+        )
+        db.add(db_file)
+        db.flush()
+        _stamp_revision(db, rev, group_ids=[file.group_id])
+
+        occurrences = Counter()
+        rows = iter(rows)
+        while True:
+            batch = []
+            for date, description, amount in islice(rows, batch_size):
+                key = fingerprint_key(file.group_id, date, description, amount, file.owner)
+                batch.append({
+                    'date': date,
+                    'iso_date': date,
+                    'description': description,
+                    'amount': amount,
+                    'action': 'Ignore',
+                    'file_id': db_file.id,
+                    'owner': file.owner,
+                    'previous_action': '',
+                    'fingerprint': row_fingerprint(key, occurrences[key]),
+                    'rev': rev
+                })
+                occurrences[key] += 1
+            if not batch:
+                break
+
+            existing = set(db.scalars(
+                select(models.Transaction.fingerprint)
+                .where(models.Transaction.fingerprint.in_([row['fingerprint'] for row in batch]))
+            ))
+            if existing:
+                batch = [row for row in batch if row['fingerprint'] not in existing]
+                if on_duplicate:
+                    on_duplicate(len(existing))
+            if not batch:
+                continue
+
+            suggestions = merchants.suggest_actions(db, file.owner, [row['description'] for row in batch])
+            for row, suggestion in zip(batch, suggestions):
+                row['suggested_action'] = suggestion
+            # The file insert above already holds the write lock
+            next_id = _next_transaction_id(db)
+            for offset, row in enumerate(batch):
+                row['id'] = next_id + offset
+            db.execute(insert(models.Transaction.__table__), batch)
+            index_descriptions(db, [(row['id'], row['description']) for row in batch])
+            _record_last_actions(db, batch)
+            apply_month_totals(db, month_total_changes(
+                (file.group_id, row['iso_date'], row['owner'], row['action'], row['amount']) for row in batch
+            ))
+            if on_progress:
+                on_progress(len(batch))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    db.refresh(db_file)
+    return db_file
+
+def _next_transaction_id(db: Session):
+    # Bulk inserts number their rows from here instead of reading ids back
+    # with RETURNING, which SQLAlchemy can only keep in row order on SQLite
+    # by sending one INSERT per row. The AUTOINCREMENT counter moves past
+    # every inserted id, so ids of archived rows are not taken again. The
+    # caller must hold the write lock, so no other writer can take the ids.
+    return (db.scalar(text("SELECT seq FROM sqlite_sequence WHERE name = 'transactions'")) or 0) + 1
+
+def next_revision(db: Session):
+    # Revision for everything the current transaction changes. The UPDATE
+    # holds SQLite's write lock until commit, so revisions become visible in
+    # the order they are handed out.
+    table = models.SyncRevision.__table__
+    return db.execute(
+        update(table).where(table.c.id == 1).values(value=table.c.value + 1).returning(table.c.value)
+    ).scalar_one()
+
+def get_revision(db: Session):
+    return db.scalar(select(models.SyncRevision.value).where(models.SyncRevision.id == 1))
+
+def get_group_revision(db: Session, group_id: int):
+    return db.scalar(select(models.UserGroup.rev).where(models.UserGroup.id == group_id))
+
+def get_file_revision(db: Session, file_id: int):
+    return db.scalar(select(models.File.rev).where(models.File.id == file_id))
+
+def _stamp_revision(db: Session, rev: int, file_ids=(), group_ids=()):
+    # Move the revision of files whose transactions changed and of the groups
+    # holding them, which is what their cached responses are tagged with
+    file_ids = set(file_ids)
+    group_ids = set(group_ids) - {None}
+    if file_ids:
+        db.execute(update(models.File).where(models.File.id.in_(file_ids)).values(rev=rev))
+    if group_ids:
+        db.execute(update(models.UserGroup).where(models.UserGroup.id.in_(group_ids)).values(rev=rev))
+
 def get_group_by_name(db: Session, name: str):
     return db.query(models.UserGroup).filter(models.UserGroup.name == name).first()
 
 def create_group(db: Session, group: schemas.UserGroupCreate):
-    db_group = models.UserGroup(name=group.name, person1=group.person1, person2=group.person2)
+    db_group = models.UserGroup(name=group.name, person1=group.person1, person2=group.person2, rev=next_revision(db))
+    names = [name for name in dict.fromkeys([group.person1, group.person2, *group.members]) if name]
+    db_group.member_rows = [models.GroupMember(name=name, position=i) for i, name in enumerate(names)]
     db.add(db_group)
     db.commit()
     db.refresh(db_group)
@@ -37,38 +256,641 @@ def create_group(db: Session, group: schemas.UserGroupCreate):
 def get_group(db: Session, group_id: int):
     return db.query(models.UserGroup).filter(models.UserGroup.id == group_id).first()
 
+def add_group_member(db: Session, group_id: int, name: str):
+    db_group = get_group(db, group_id=group_id)
+    if db_group is None:
+        return None
+    if name not in db_group.members:
+        db_group.member_rows.append(models.GroupMember(name=name, position=len(db_group.member_rows)))
+        db_group.rev = next_revision(db)
+        db.commit()
+        db.refresh(db_group)
+    return db_group
+
+def update_group(db: Session, group_id: int, **fields):
+    db_group = get_group(db, group_id=group_id)
+    if db_group is None:
+        return None
+    for name, value in fields.items():
+        setattr(db_group, name, value)
+    db_group.rev = next_revision(db)
+    db.commit()
+    db.refresh(db_group)
+    return db_group
+
 def get_groups(db: Session):
     return db.query(models.UserGroup).all()
 
-def create_transaction(db: Session, transaction: schemas.TransactionCreate):
-    db_transaction = models.Transaction(**transaction.model_dump())
-    db.add(db_transaction)
-    db.commit()
-    db.refresh(db_transaction)
-    return db_transaction
 
+UPSERT_CHUNK_SIZE = 5000
 
-def create_or_update_transaction(db: Session, transaction: schemas.TransactionCreate):
-    # Check if the transaction already exists by unique attributes
-    existing_transaction = db.query(models.Transaction).filter(
-        models.Transaction.file_id == transaction.file_id,
-        models.Transaction.date == transaction.date,
-        models.Transaction.description == transaction.description,
-        models.Transaction.amount == transaction.amount
-    ).first()
+def upsert_transactions(db: Session, transactions: List[schemas.TransactionCreate]):
+    # A transaction matching a stored row on file_id, date, description and
+    # amount updates that row's action, previous action and owner (the oldest
+    # row when several match); any other is inserted. The whole batch is
+    # resolved with one lookup per chunk, one executemany UPDATE and one
+    # INSERT, then committed once
+    Transaction = models.Transaction
+    match_columns = (Transaction.file_id, Transaction.date, Transaction.description, Transaction.amount)
+    keys = [(t.file_id, t.date, t.description, t.amount) for t in transactions]
+
+    existing = {}
+    stored = {}
+    buckets = {}
+    for chunk in _chunks(list(dict.fromkeys(keys)), UPSERT_CHUNK_SIZE):
+        # Joining a VALUES list lets SQLite seek ix_transactions_match per key,
+        # where a row-value IN list would scan the table
+        match_keys = values(
+            column('file_id', Integer), column('date', String), column('description', String), column('amount', Float),
+            name='match_keys'
+        ).data(chunk).cte()
+        rows = db.execute(
+            select(
+                Transaction.id, Transaction.action, Transaction.owner, Transaction.iso_date, Transaction.suggested_action,
+                *match_columns
+            )
+            .join(match_keys, and_(*(
+                match_column == key_column for match_column, key_column in zip(match_columns, match_keys.c)
+            )))
+            .order_by(Transaction.id)
+        )
+        for row in rows:
+            key = tuple(row[5:])
+            if key not in existing:
+                existing[key] = row.id
+                stored[row.id] = (key, row.action, row.suggested_action)
+                buckets[row.id] = (row.iso_date, row.owner, row.action, row.amount)
+
+    updates = {}
+    inserts = {}
+    for key, transaction in zip(keys, transactions):
+        if key in existing:
+            updates[existing[key]] = {
+                'id': existing[key],
+                'action': transaction.action,
+                'previous_action': transaction.previous_action,
+                'owner': transaction.owner
+            }
+        else:
+            inserts[key] = {**transaction.model_dump(), 'iso_date': formats.sortable_date(transaction.date)}
 
-    if existing_transaction:
-        # Update the existing transaction
-        existing_transaction.action = transaction.action
-        existing_transaction.previous_action = transaction.previous_action
-        existing_transaction.owner = transaction.owner
+    # Confirmed actions for the merchant index, per owner, as
+    # (description, old action, new action); one entry per distinct key
+    learned = {}
+    for key, transaction in dict(zip(keys, transactions)).items():
+        old = stored[existing[key]][1] if key in existing else None
+        learned.setdefault(transaction.owner, []).append((transaction.description, old, transaction.action))
+
+    # (file_id, amount, old action, new action) for every row whose share of
+    # the file balances may change
+    changes = [
+        (stored[id][0][0], stored[id][0][3], stored[id][1], values['action'])
+        for id, values in updates.items()
+    ] + [
+        (values['file_id'], values['amount'], None, values['action'])
+        for values in inserts.values()
+    ]
+
+    # Month buckets lose the stored rows' old owner/action and gain the new
+    file_groups = dict(db.execute(
+        select(models.File.id, models.File.group_id).where(models.File.id.in_({key[0] for key in keys}))
+    ).all()) if keys else {}
+    month_totals = {}
+    for id, change in updates.items():
+        group_id = file_groups.get(stored[id][0][0])
+        iso_date, owner, action, amount = buckets[id]
+        month_total_changes([(group_id, iso_date, owner, action, amount)], -1, month_totals)
+        month_total_changes([(group_id, iso_date, change['owner'], change['action'], amount)], 1, month_totals)
+    month_total_changes((
+        (file_groups.get(row['file_id']), row['iso_date'], row['owner'], row['action'], row['amount'])
+        for row in inserts.values()
+    ), 1, month_totals)
+
+    try:
+        rev = next_revision(db)
+        _apply_file_balance_changes(db, changes, rev)
+        _stamp_revision(db, rev, file_groups.keys(), file_groups.values())
+        apply_month_totals(db, month_totals)
+        if updates:
+            db.execute(update(Transaction), [{**row, 'rev': rev} for row in updates.values()])
+        if inserts:
+            # next_revision above took the write lock
+            next_id = _next_transaction_id(db)
+            ids = list(range(next_id, next_id + len(inserts)))
+            db.execute(
+                insert(Transaction.__table__),
+                [{**row, 'id': id, 'rev': rev} for id, row in zip(ids, inserts.values())]
+            )
+            existing.update(zip(inserts.keys(), ids))
+            index_descriptions(db, [(id, row['description']) for id, row in zip(ids, inserts.values())])
+
+        # Inserted rows have no suggestion; only uploads make them
+        processed = [
+            {
+                **transaction.model_dump(),
+                'id': existing[key],
+                'suggested_action': stored[existing[key]][2] if existing[key] in stored else None
+            }
+            for key, transaction in zip(keys, transactions)
+        ]
+        _record_last_actions(db, [
+            {**transaction, 'iso_date': formats.sortable_date(transaction['date'])}
+            for transaction in processed
+        ])
         db.commit()
-        db.refresh(existing_transaction)
-        return existing_transaction
-    else:
-        # Create a new transaction if it doesn't exist
-        db_transaction = models.Transaction(**transaction.dict())
-        db.add(db_transaction)
+    except Exception:
+        db.rollback()
+        raise
+
+    for owner, owner_changes in learned.items():
+        merchants.record_actions(owner, owner_changes)
+    return processed
+
+
+def delete_file(db: Session, db_file: models.File):
+    Transaction = models.Transaction
+    LastAction = models.LastAction
+    file_transaction_ids = select(Transaction.id).where(Transaction.file_id == db_file.id)
+    owner = db_file.owner
+
+    try:
+        # Entries pointing into this file are rebuilt from what remains
+        stale = db.execute(
+            select(LastAction.owner, LastAction.description)
+            .where(LastAction.transaction_id.in_(file_transaction_ids))
+        ).all()
+        db.execute(delete(LastAction).where(LastAction.transaction_id.in_(file_transaction_ids)))
+        month, bucket_owner, action = _month_bucket_columns()
+        apply_month_totals(db, {
+            (db_file.group_id, *key): [-(total or 0), -count]
+            for *key, total, count in db.execute(
+                select(month, bucket_owner, action, func.sum(Transaction.amount), func.count())
+                .where(Transaction.file_id == db_file.id)
+                .group_by(month, bucket_owner, action)
+            )
+        })
+        unindex_descriptions(db, Transaction.file_id == db_file.id)
+        db.query(Transaction).filter(Transaction.file_id == db_file.id).delete()
+        rebuild_last_actions(db, [tuple(row) for row in stale])
+        _apply_group_balance_delta(db, db_file.group_id, -(db_file.balance_person1 or 0), -(db_file.balance_person2 or 0))
+        rev = next_revision(db)
+        db.add(models.Tombstone(rev=rev, kind='file', object_id=db_file.id, group_id=db_file.group_id))
+        _stamp_revision(db, rev, group_ids=[db_file.group_id])
+        db.delete(db_file)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    merchants.forget(owner)
+
+
+def update_file_balances(db: Session, db_file: models.File, balances: schemas.FileBalanceUpdate):
+    try:
+        _apply_group_balance_delta(
+            db,
+            db_file.group_id,
+            balances.balance_person1 - (db_file.balance_person1 or 0),
+            balances.balance_person2 - (db_file.balance_person2 or 0)
+        )
+        db_file.balance_person1 = balances.balance_person1
+        db_file.balance_person2 = balances.balance_person2
+        db_file.rev = next_revision(db)
+        _stamp_revision(db, db_file.rev, group_ids=[db_file.group_id])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    db.refresh(db_file)
+    return db_file
+
+
+def recompute_file_balances(db: Session, db_file: models.File):
+    # Full recomputation from the file's transactions read as column arrays
+    rows = db.execute(
+        select(models.Transaction.amount, models.Transaction.action)
+        .where(models.Transaction.file_id == db_file.id)
+    ).all()
+    amounts, actions = zip(*rows) if rows else ((), ())
+    group = db_file.group
+    shares = balances.action_shares(group.person1, group.person2) if group else balances.ACTION_SHARES
+    balance_person1, balance_person2 = balances.compute_balances(amounts, actions, shares)
+    return update_file_balances(
+        db=db,
+        db_file=db_file,
+        balances=schemas.FileBalanceUpdate(balance_person1=balance_person1, balance_person2=balance_person2)
+    )
+
+
+def get_member_totals(db: Session, group_id: int):
+    # (payer, action, total amount) across every file of a group in one
+    # aggregate query; balances.net_balances turns these into member nets
+    Transaction = models.Transaction
+    return db.execute(
+        select(Transaction.owner, Transaction.action, func.sum(Transaction.amount))
+        .join(models.File, models.File.id == Transaction.file_id)
+        .where(models.File.group_id == group_id)
+        .group_by(Transaction.owner, Transaction.action)
+    ).all()
+
+
+def create_settlement_files(db: Session, db_group: models.UserGroup, transfers, date: str):
+    # One file per paying member holding a transaction per transfer: the
+    # debtor pays `amount` and the whole of it is put on the creditor, which
+    # moves both of their nets to zero
+    Transaction = models.Transaction
+    by_debtor = {}
+    for debtor, creditor, amount in transfers:
+        by_debtor.setdefault(debtor, []).append((creditor, amount))
+
+    try:
+        rev = next_revision(db)
+        _stamp_revision(db, rev, group_ids=[db_group.id])
+        for debtor, payments in by_debtor.items():
+            db_file = models.File(name=f"Settlement {date}", group_id=db_group.id, owner=debtor, rev=rev)
+            db.add(db_file)
+            db.flush()
+            rows = [
+                {
+                    'date': date,
+                    'iso_date': date,
+                    'description': f"Settlement to {creditor}",
+                    'amount': -amount,
+                    'action': creditor,
+                    'file_id': db_file.id,
+                    'owner': debtor,
+                    'previous_action': '',
+                    'rev': rev
+                }
+                for creditor, amount in payments
+            ]
+            next_id = _next_transaction_id(db)
+            ids = list(range(next_id, next_id + len(rows)))
+            db.execute(insert(Transaction.__table__), [{**row, 'id': id} for id, row in zip(ids, rows)])
+            index_descriptions(db, [(id, row['description']) for id, row in zip(ids, rows)])
+            _apply_file_balance_changes(db, [(db_file.id, row['amount'], None, row['action']) for row in rows], rev)
+            _record_last_actions(db, [{**row, 'id': id} for row, id in zip(rows, ids)])
+            apply_month_totals(db, month_total_changes(
+                (db_group.id, row['iso_date'], row['owner'], row['action'], row['amount']) for row in rows
+            ))
         db.commit()
-        db.refresh(db_transaction)
-        return db_transaction
+    except Exception:
+        db.rollback()
+        raise
+
+
+def get_group_balances(db: Session, group_id: int = None):
+    # One query for every group (or a single one) with its balances
+    GroupBalance = models.GroupBalance
+    query = (
+        db.query(
+            models.UserGroup,
+            func.coalesce(GroupBalance.balance_person1, 0.0),
+            func.coalesce(GroupBalance.balance_person2, 0.0)
+        )
+        .outerjoin(GroupBalance, GroupBalance.group_id == models.UserGroup.id)
+        .order_by(models.UserGroup.id)
+    )
+    if group_id is not None:
+        query = query.filter(models.UserGroup.id == group_id)
+    return query.all()
+
+def rebuild_group_balances(db: Session):
+    File = models.File
+    db.execute(delete(models.GroupBalance))
+    db.execute(insert(models.GroupBalance).from_select(
+        ['group_id', 'balance_person1', 'balance_person2'],
+        select(
+            File.group_id,
+            func.coalesce(func.sum(File.balance_person1), 0.0),
+            func.coalesce(func.sum(File.balance_person2), 0.0)
+        )
+        .where(File.group_id.isnot(None))
+        .group_by(File.group_id)
+    ))
+
+def _apply_file_balance_changes(db: Session, changes, rev: int):
+    # Add the balance deltas of changed actions to their files (and groups)
+    # without rescanning the files; changed files get revision `rev`
+    if not changes:
+        return
+    File = models.File
+    by_file = {}
+    for file_id, amount, old_action, new_action in changes:
+        if old_action != new_action:
+            by_file.setdefault(file_id, []).append((amount, old_action, new_action))
+    if not by_file:
+        return
+
+    files = db.execute(
+        select(File.id, File.group_id, models.UserGroup.person1, models.UserGroup.person2)
+        .outerjoin(models.UserGroup, models.UserGroup.id == File.group_id)
+        .where(File.id.in_(list(by_file)))
+    ).all()
+
+    file_deltas = []
+    group_deltas = {}
+    for file_id, group_id, person1, person2 in files:
+        amounts, old_actions, new_actions = zip(*by_file[file_id])
+        delta_person1, delta_person2 = balances.balance_deltas(
+            amounts, old_actions, new_actions, balances.action_shares(person1, person2)
+        )
+        if not delta_person1 and not delta_person2:
+            continue
+        file_deltas.append({'file_id': file_id, 'delta_person1': delta_person1, 'delta_person2': delta_person2})
+        group_delta = group_deltas.setdefault(group_id, [0.0, 0.0])
+        group_delta[0] += delta_person1
+        group_delta[1] += delta_person2
+
+    if file_deltas:
+        files_table = File.__table__
+        db.execute(
+            update(files_table)
+            .where(files_table.c.id == bindparam('file_id'))
+            .values(
+                balance_person1=func.coalesce(files_table.c.balance_person1, 0.0) + bindparam('delta_person1'),
+                balance_person2=func.coalesce(files_table.c.balance_person2, 0.0) + bindparam('delta_person2'),
+                rev=rev
+            ),
+            file_deltas
+        )
+    for group_id, (delta_person1, delta_person2) in group_deltas.items():
+        _apply_group_balance_delta(db, group_id, delta_person1, delta_person2)
+
+def _apply_group_balance_delta(db: Session, group_id: int, delta_person1: float, delta_person2: float):
+    if group_id is None or (not delta_person1 and not delta_person2):
+        return
+    GroupBalance = models.GroupBalance
+    stmt = sqlite_insert(GroupBalance).values(
+        group_id=group_id,
+        balance_person1=delta_person1,
+        balance_person2=delta_person2
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['group_id'],
+        set_={
+            'balance_person1': GroupBalance.balance_person1 + stmt.excluded.balance_person1,
+            'balance_person2': GroupBalance.balance_person2 + stmt.excluded.balance_person2
+        }
+    )
+    db.execute(stmt)
+
+
+def month_total_changes(rows, sign: int = 1, changes: dict = None):
+    # Bucket deltas {(group_id, month, owner, action): [total, count]} for
+    # rows of (group_id, iso_date, owner, action, amount) being added
+    # (sign 1) or removed (sign -1), optionally added to `changes`. Files
+    # outside a group have no buckets.
+    changes = {} if changes is None else changes
+    for group_id, iso_date, owner, action, amount in rows:
+        if group_id is None:
+            continue
+        bucket = changes.setdefault((group_id, (iso_date or '')[:7], owner or '', action or ''), [0.0, 0])
+        bucket[0] += sign * (amount or 0)
+        bucket[1] += sign
+    return changes
+
+def apply_month_totals(db: Session, changes):
+    # Add bucket deltas from month_total_changes, dropping emptied buckets
+    changes = {key: value for key, value in changes.items() if value[1] or value[0]}
+    if not changes:
+        return
+    GroupMonthTotal = models.GroupMonthTotal
+    stmt = sqlite_insert(GroupMonthTotal)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['group_id', 'month', 'owner', 'action'],
+        set_={
+            'total': GroupMonthTotal.total + stmt.excluded.total,
+            'count': GroupMonthTotal.count + stmt.excluded.count
+        }
+    )
+    db.execute(stmt, [
+        {'group_id': group_id, 'month': month, 'owner': owner, 'action': action, 'total': total, 'count': count}
+        for (group_id, month, owner, action), (total, count) in changes.items()
+    ])
+    db.execute(delete(GroupMonthTotal).where(
+        GroupMonthTotal.group_id.in_(list({key[0] for key in changes})),
+        GroupMonthTotal.count <= 0
+    ))
+
+def _month_bucket_columns():
+    Transaction = models.Transaction
+    return (
+        func.coalesce(func.substr(Transaction.iso_date, 1, 7), ''),
+        func.coalesce(Transaction.owner, ''),
+        func.coalesce(Transaction.action, '')
+    )
+
+def rebuild_month_totals(db: Session):
+    # Recompute the buckets of every group from the transactions table
+    Transaction = models.Transaction
+    month, owner, action = _month_bucket_columns()
+    db.execute(delete(models.GroupMonthTotal))
+    db.execute(insert(models.GroupMonthTotal).from_select(
+        ['group_id', 'month', 'owner', 'action', 'total', 'count'],
+        select(models.File.group_id, month, owner, action, func.coalesce(func.sum(Transaction.amount), 0.0), func.count())
+        .join(models.File, models.File.id == Transaction.file_id)
+        .where(models.File.group_id.isnot(None))
+        .group_by(models.File.group_id, month, owner, action)
+    ))
+
+def get_month_totals(db: Session, group_id: int, month_from: str = None, month_to: str = None):
+    # (month, owner, action, total, count) buckets of a group, months inclusive
+    GroupMonthTotal = models.GroupMonthTotal
+    query = (
+        select(GroupMonthTotal.month, GroupMonthTotal.owner, GroupMonthTotal.action, GroupMonthTotal.total, GroupMonthTotal.count)
+        .where(GroupMonthTotal.group_id == group_id)
+        .order_by(GroupMonthTotal.month, GroupMonthTotal.owner, GroupMonthTotal.action)
+    )
+    if month_from is not None:
+        query = query.where(GroupMonthTotal.month >= month_from)
+    if month_to is not None:
+        query = query.where(GroupMonthTotal.month <= month_to)
+    return db.execute(query).all()
+
+def get_group_summary(db: Session, group_id: int, month_from: str = None, month_to: str = None):
+    # Rollups by month, action and owner from the month buckets alone
+    by_month, by_action, by_owner = {}, {}, {}
+    for month, owner, action, total, count in get_month_totals(db, group_id, month_from, month_to):
+        for rollup, key in ((by_month, month), (by_action, action), (by_owner, owner)):
+            bucket = rollup.setdefault(key, [0.0, 0])
+            bucket[0] += total
+            bucket[1] += count
+    return {
+        'group_id': group_id,
+        'month_from': month_from,
+        'month_to': month_to,
+        'total': sum(total for total, _ in by_month.values()),
+        'count': sum(count for _, count in by_month.values()),
+        'by_month': [{'month': key, 'total': total, 'count': count} for key, (total, count) in sorted(by_month.items())],
+        'by_action': [{'action': key, 'total': total, 'count': count} for key, (total, count) in sorted(by_action.items())],
+        'by_owner': [{'owner': key, 'total': total, 'count': count} for key, (total, count) in sorted(by_owner.items())],
+    }
+
+
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+def index_descriptions(db: Session, rows):
+    # Adds (transaction id, description) pairs to the search index
+    if rows:
+        db.execute(insert(models.transactions_fts), [{'rowid': id, 'description': description} for id, description in rows])
+
+def unindex_descriptions(db: Session, condition):
+    # Drops the transactions matching `condition` from the search index.
+    # FTS5 needs the indexed text to remove an entry, so this must run while
+    # the rows are still in the table.
+    Transaction = models.Transaction
+    db.execute(insert(models.transactions_fts).from_select(
+        ['transactions_fts', 'rowid', 'description'],
+        select(literal('delete'), Transaction.id, Transaction.description).where(condition)
+    ))
+
+def search_query(text: str):
+    # Each word of the user's text as a quoted prefix term, all of them
+    # required: 'costco wh' -> '"costco"* "wh"*'. Quoting keeps FTS5 syntax
+    # (AND, NEAR, column filters, ...) in the input from being interpreted.
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', text or ''))
+
+def search_transactions(db: Session, text: str, group_id: int = None, owner: str = None,
+                        date_from: str = None, date_to: str = None, order: str = 'rank',
+                        after_rank: float = None, after_id: int = None, limit: int = 50):
+    # Transactions of hot groups whose description matches `text`. 'rank'
+    # puts the best matches first (FTS5 rank, bm25: lower is better), then
+    # orders by id; the keyset is the (rank, id) of the previous page's last
+    # row. Every match is scored, so a word found in a large share of all
+    # rows is slow. 'recent' lists the newest transactions first, which
+    # FTS5 reads straight off its index, so that is fast for any word; the
+    # keyset is the last id.
+    Transaction, File, fts = models.Transaction, models.File, models.transactions_fts
+    query = search_query(text)
+    if not query:
+        return []
+    stmt = (
+        select(*_transaction_columns(), File.group_id, fts.c.rank)
+        .select_from(fts)
+        .join(Transaction, Transaction.id == fts.c.rowid)
+        .join(File, File.id == Transaction.file_id)
+        .where(fts.c.transactions_fts.match(query), *transaction_filters(date_from=date_from, date_to=date_to))
+    )
+    if group_id is not None:
+        stmt = stmt.where(File.group_id == group_id)
+    if owner is not None:
+        stmt = stmt.where(Transaction.owner == owner)
+    if order == 'recent':
+        # Constraints on the rowid itself are handed to FTS5
+        stmt = stmt.order_by(fts.c.rowid.desc())
+        if after_id is not None:
+            stmt = stmt.where(fts.c.rowid < after_id)
+    else:
+        stmt = stmt.order_by(fts.c.rank, Transaction.id)
+        if after_rank is not None:
+            stmt = stmt.where(tuple_(fts.c.rank, Transaction.id) > tuple_(after_rank, after_id))
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return db.execute(stmt).all()
+
+def rebuild_search_index(db: Session):
+    db.execute(insert(models.transactions_fts).values(transactions_fts='rebuild'))
+
+
+def normalize_description(description: str):
+    # Matches SQLite's lower(trim(description)) so keys can be built in SQL too
+    return description.strip(' ').translate(_ASCII_LOWER)
+
+def get_last_actions(db: Session, owner: str, descriptions: List[str]):
+    LastAction = models.LastAction
+    keys = {description: normalize_description(description) for description in descriptions}
+
+    found = {}
+    for chunk in _chunks(list(set(keys.values())), UPSERT_CHUNK_SIZE):
+        found.update(db.execute(
+            select(LastAction.description, LastAction.action)
+            .where(LastAction.owner == owner, LastAction.description.in_(chunk))
+        ).all())
+
+    actions = {description: found[key] for description, key in keys.items() if key in found}
+    # Descriptions never seen verbatim fall back to what the merchant index
+    # suggests, e.g. the same store under a new store number
+    unseen = [description for description in keys if description not in actions]
+    for description, suggestion in zip(unseen, merchants.suggest_actions(db, owner, unseen)):
+        if suggestion is not None:
+            actions[description] = suggestion
+    return actions
+
+def rebuild_last_actions(db: Session, keys=None):
+    # Recompute entries from the transactions table, either for every
+    # (owner, normalized description) or only for the given keys
+    Transaction = models.Transaction
+    LastAction = models.LastAction
+    description_key = func.lower(func.trim(Transaction.description))
+
+    ranked = select(
+        Transaction.owner,
+        description_key.label('description'),
+        Transaction.action,
+        Transaction.iso_date.label('date'),
+        Transaction.id.label('transaction_id'),
+        func.row_number().over(
+            partition_by=(Transaction.owner, description_key),
+            order_by=(Transaction.iso_date.desc(), Transaction.id.desc())
+        ).label('rank')
+    ).where(Transaction.owner.isnot(None), Transaction.description.isnot(None))
+
+    chunks = [None] if keys is None else _chunks(keys, UPSERT_CHUNK_SIZE)
+    for chunk in chunks:
+        query = ranked
+        if chunk is not None:
+            rebuild_keys = values(column('owner', String), column('description', String), name='rebuild_keys').data(chunk).cte()
+            query = ranked.join(rebuild_keys, and_(
+                Transaction.owner == rebuild_keys.c.owner,
+                description_key == rebuild_keys.c.description
+            ))
+        latest = query.subquery()
+        db.execute(insert(LastAction).from_select(
+            ['owner', 'description', 'action', 'date', 'transaction_id'],
+            select(latest.c.owner, latest.c.description, latest.c.action, latest.c.date, latest.c.transaction_id)
+            .where(latest.c.rank == 1)
+        ))
+
+def _record_last_actions(db: Session, transactions):
+    # Fold a batch of written transactions into last_actions, keeping an
+    # entry only when it is at least as recent as the stored one
+    LastAction = models.LastAction
+    latest = {}
+    for transaction in transactions:
+        if transaction['owner'] is None or transaction['description'] is None:
+            continue
+        key = (transaction['owner'], normalize_description(transaction['description']))
+        entry = {
+            'owner': key[0],
+            'description': key[1],
+            'action': transaction['action'],
+            'date': transaction['iso_date'],
+            'transaction_id': transaction['id']
+        }
+        current = latest.get(key)
+        if current is None or (entry['date'] or '', entry['transaction_id']) >= (current['date'] or '', current['transaction_id']):
+            latest[key] = entry
+
+    if not latest:
+        return
+
+    stmt = sqlite_insert(LastAction)
+    new_date = func.coalesce(stmt.excluded.date, '')
+    old_date = func.coalesce(LastAction.date, '')
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['owner', 'description'],
+        set_={
+            'action': stmt.excluded.action,
+            'date': stmt.excluded.date,
+            'transaction_id': stmt.excluded.transaction_id
+        },
+        where=or_(
+            new_date > old_date,
+            and_(new_date == old_date, stmt.excluded.transaction_id >= LastAction.transaction_id)
+        )
+    )
+    db.execute(stmt, list(latest.values()))
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
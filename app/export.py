@@ -0,0 +1,87 @@
+import csv
+import io
+import json
+
+from . import archive, crud
+from .database import SessionLocal
+
+# Group exports are produced batch by batch from keyset reads (or archive
+# record batches for cold groups), so memory stays bounded by
+# EXPORT_BATCH_SIZE rows whatever the size of the group
+EXPORT_BATCH_SIZE = 5000
+FIELDS = archive.TRANSACTION_FIELDS
+
+
+def iter_rows(group_id: int, cold: bool, date_from: str = None, date_to: str = None, actions=None):
+    # Batches of row tuples in FIELDS order
+    if cold:
+        yield from archive.iter_group_batches(group_id, date_from=date_from, date_to=date_to, actions=actions)
+        return
+    filters = crud.transaction_filters(date_from=date_from, date_to=date_to, actions=actions)
+    # A session of its own, since the body is produced after the handler returns
+    with SessionLocal() as db:
+        yield from crud.iter_group_transaction_batches(db, group_id, batch_size=EXPORT_BATCH_SIZE, filters=filters)
+
+
+def to_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def to_ndjson(batches):
+    for batch in batches:
+        yield "".join(json.dumps(dict(zip(FIELDS, row))) + "\n" for row in batch)
+
+
+class _Chunks(io.RawIOBase):
+    # Write-only file that hands what was written so far to the generator
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def to_parquet(batches):
+    # One row group per batch
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = archive.arrow_schema(FIELDS)
+    sink = _Chunks()
+    with pq.ParquetWriter(sink, schema, compression="zstd") as writer:
+        for batch in batches:
+            writer.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(zip(*batch), schema)],
+                schema=schema
+            ))
+            yield sink.drain()
+    yield sink.drain()
+
+
+FORMATS = {
+    "csv": (to_csv, "text/csv"),
+    "ndjson": (to_ndjson, "application/x-ndjson"),
+    "parquet": (to_parquet, "application/vnd.apache.parquet"),
+}
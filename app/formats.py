@@ -0,0 +1,122 @@
+import datetime
+
+# Statement formats are plain data: adding a bank means adding a BankFormat
+# entry to the registry below.
+
+DEFAULT_DATE_FORMATS = ('%m/%d/%Y', '%m/%d/%y', '%Y-%m-%d')
+
+
+class BankFormat:
+    def __init__(self, name: str, headers: dict, sign: int = 1, date_formats=DEFAULT_DATE_FORMATS, drop=()):
+        self.name = name
+        self.headers = headers
+        self.sign = sign
+        self.date_formats = tuple(date_formats)
+        self.drop = tuple(drop)
+        self.signature = frozenset(headers)
+        self.source = {target: name for name, target in headers.items()}
+
+
+_by_signature = {}
+_by_specificity = []
+
+
+def register(bank_format: BankFormat):
+    _by_signature[bank_format.signature] = bank_format
+    _by_specificity.append(bank_format)
+    # Most specific first so a superset header (Wells Fargo) is not taken
+    # for a subset one (AMEX) when a file carries extra columns
+    _by_specificity.sort(key=lambda f: len(f.signature), reverse=True)
+
+
+def match(columns):
+    columns = frozenset(columns)
+    bank_format = _by_signature.get(columns)
+    if bank_format is not None:
+        return bank_format
+
+    for bank_format in _by_specificity:
+        if bank_format.signature <= columns:
+            return bank_format
+    return None
+
+
+def parse_date(value: str, date_formats=DEFAULT_DATE_FORMATS):
+    if value is None:
+        return None
+    for date_format in date_formats:
+        try:
+            return datetime.datetime.strptime(value, date_format).date().isoformat()
+        except ValueError:
+            pass
+    raise ValueError(f"Unrecognized date: {value}")
+
+
+def sortable_date(value: str):
+    # Like parse_date, but NULL instead of an error for dates we cannot read
+    try:
+        return parse_date(value)
+    except ValueError:
+        return None
+
+
+def to_cents(value, sign: int = 1):
+    if value is None:
+        return None
+    return int(round(float(value) * 100)) * sign
+
+
+def normalize_frame(bank_format: BankFormat, df):
+    # Columnar version of parse_date/to_cents for the pandas engine
+    import pandas as pd
+
+    df = df.rename(columns=bank_format.headers)
+    df = df.drop(columns=list(bank_format.drop), errors='ignore')
+
+    raw_dates = df['Transaction_Date']
+    dates = pd.to_datetime(raw_dates, format=bank_format.date_formats[0], errors='coerce')
+    for date_format in bank_format.date_formats[1:]:
+        dates = dates.fillna(pd.to_datetime(raw_dates, format=date_format, errors='coerce'))
+    unparsed = dates.isna() & raw_dates.notna()
+    if unparsed.any():
+        raise ValueError(f"Unrecognized date: {raw_dates[unparsed].iloc[0]}")
+    df['Transaction_Date'] = dates.dt.strftime('%Y-%m-%d')
+
+    cents = (df['Amount'].astype(float) * 100).round() * bank_format.sign
+    df['Amount_Cents'] = cents.astype('Int64')
+    df['Amount'] = df['Amount_Cents'] / 100
+    return df
+
+
+register(BankFormat('Chase', {
+    'Transaction Date': 'Transaction_Date',
+    'Post Date': 'Post_Date',
+    'Description': 'Description',
+    'Category': 'Category',
+    'Type': 'Budget',
+    'Amount': 'Amount',
+    'Memo': 'Memo'
+}))
+
+register(BankFormat('US Bank', {
+    'Date': 'Transaction_Date',
+    'Transaction': 'Type',
+    'Name': 'Description',
+    'Memo': 'Memo',
+    'Amount': 'Amount'
+}))
+
+# AMEX reports charges as positive amounts
+register(BankFormat('AMEX', {
+    'Date': 'Transaction_Date',
+    'Description': 'Description',
+    'Amount': 'Amount'
+}, sign=-1))
+
+register(BankFormat('Wells Fargo', {
+    'Date': 'Transaction_Date',
+    'Description': 'Description',
+    'Empty1': 'Empty1',
+    'Empty2': 'Empty2',
+    'Amount': 'Amount'
+}, drop=('Empty1', 'Empty2')))
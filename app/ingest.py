@@ -0,0 +1,125 @@
+import csv
+import logging
+import os
+import time
+
+from . import formats
+
+logger = logging.getLogger(__name__)
+
+# "pandas" loads the whole statement into a DataFrame, "stream" parses it row
+# by row with the csv module so memory stays flat for any file size
+INGEST_ENGINE = os.getenv("INGEST_ENGINE", "pandas")
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Strings pandas.read_csv treats as missing by default
+NA_VALUES = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+    '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a',
+    'nan', 'null'
+}
+
+
+def translate_headers(df):
+    bank_format = formats.match(df.columns)
+    if bank_format is None:
+        return None
+    return formats.normalize_frame(bank_format, df)
+
+def read_statement(file_path, engine: str = None, timings: dict = None):
+    # Returns an iterator of (date, description, amount) rows. The header is
+    # checked up front so an unsupported file fails before anything is written.
+    # Seconds spent reading, translating headers and parsing values are added
+    # to `timings`; the stream engine only completes them once the rows have
+    # been consumed.
+    engine = engine or INGEST_ENGINE
+    timings = {} if timings is None else timings
+    if engine == "pandas":
+        return _read_statement_pandas(file_path, timings)
+    if engine == "stream":
+        return _read_statement_stream(file_path, timings)
+    raise ValueError(f"Unknown ingest engine: {engine}")
+
+def parse_statement(file_path, engine: str = None):
+    # read_statement run to completion, for the batch upload process pool:
+    # the rows come back as a list together with the stage timings
+    timings = {}
+    rows = list(read_statement(file_path, engine=engine, timings=timings))
+    return rows, timings
+
+def frame_rows(df):
+    return zip(
+        _column(df['Transaction_Date']),
+        _column(df['Description']),
+        _column(df['Amount'])
+    )
+
+def _column(series):
+    return series.astype(object).where(series.notna(), None).tolist()
+
+def _read_statement_pandas(file_path, timings):
+    import pandas as pd
+
+    start = time.perf_counter()
+    df = pd.read_csv(file_path)
+    read = time.perf_counter()
+    bank_format = formats.match(df.columns)
+    if bank_format is None:
+        raise ValueError("Unsupported bank")
+    translated = time.perf_counter()
+    rows = frame_rows(formats.normalize_frame(bank_format, df))
+    timings.update(read=read - start, translate=translated - read, parse=time.perf_counter() - translated)
+    return rows
+
+def _read_statement_stream(file_path, timings):
+    start = time.perf_counter()
+    f = open(file_path, newline='', encoding='utf-8-sig')
+    try:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        read = time.perf_counter()
+        bank_format = formats.match(header or [])
+        if bank_format is None:
+            raise ValueError("Unsupported bank")
+    except Exception:
+        f.close()
+        raise
+
+    date_index = header.index(bank_format.source['Transaction_Date'])
+    description_index = header.index(bank_format.source['Description'])
+    amount_index = header.index(bank_format.source['Amount'])
+    logger.debug(f"Streaming {bank_format.name} statement with columns: {header}")
+    timings.update(read=read - start, translate=time.perf_counter() - read, parse=0.0)
+    return _stream_rows(f, reader, bank_format, date_index, description_index, amount_index, timings)
+
+def _stream_rows(f, reader, bank_format, date_index, description_index, amount_index, timings):
+    # Reading and parsing alternate row by row, so each is timed per row
+    # and added up as the rows are consumed
+    read = parse = 0.0
+    try:
+        with f:
+            while True:
+                start = time.perf_counter()
+                record = next(reader, None)
+                parsed = time.perf_counter()
+                read += parsed - start
+                if record is None:
+                    return
+                if not record:
+                    continue
+                cents = formats.to_cents(_field(record, amount_index), bank_format.sign)
+                row = (
+                    formats.parse_date(_field(record, date_index), bank_format.date_formats),
+                    _field(record, description_index),
+                    None if cents is None else cents / 100
+                )
+                parse += time.perf_counter() - parsed
+                yield row
+    finally:
+        timings['read'] += read
+        timings['parse'] += parse
+
+def _field(record, index):
+    if index >= len(record) or record[index] in NA_VALUES:
+        return None
+    return record[index]
@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from . import crud, metrics, schemas
+from .ingest import parse_statement, read_statement
+from .writer import write_queue
+
+logger = logging.getLogger(__name__)
+
+# Uploads are parsed on a small pool of their own so a burst of large
+# statements cannot take the threads that serve regular requests
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "16"))
+INGEST_KEEP_FINISHED = int(os.getenv("INGEST_KEEP_FINISHED", "1000"))
+
+# Batch uploads parse their statements on a process pool instead, since
+# parsing is CPU-bound and threads would take turns on the GIL
+INGEST_PROCESSES = int(os.getenv("INGEST_PROCESSES", str(os.cpu_count() or 1)))
+
+_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+_processes = None
+_pending = threading.BoundedSemaphore(INGEST_MAX_PENDING)
+_jobs = OrderedDict()
+_lock = threading.Lock()
+
+
+class QueueFull(Exception):
+    pass
+
+
+class IngestJob:
+    def __init__(self, group_id: int, owner: str, filename: str, batched: bool = False):
+        self.id = uuid.uuid4().hex
+        self.group_id = group_id
+        self.owner = owner
+        self.filename = filename
+        self.status = "queued"
+        self.rows_parsed = 0
+        self.rows_inserted = 0
+        self.rows_duplicate = 0
+        self.duplicate = False
+        self.timings = {}
+        self.file_id = None
+        self.error = None
+        # Jobs of a batch upload share its pending slot, released by run_batch
+        self.batched = batched
+
+
+def create_job(group_id: int, owner: str, filename: str) -> IngestJob:
+    if not _pending.acquire(blocking=False):
+        raise QueueFull("Too many uploads in progress")
+
+    job = IngestJob(group_id=group_id, owner=owner, filename=filename)
+    with _lock:
+        _jobs[job.id] = job
+        _prune()
+    return job
+
+
+def create_batch_jobs(group_id: int, owner: str, filenames) -> list:
+    # A batch upload takes a single pending slot however many files it holds
+    if not _pending.acquire(blocking=False):
+        raise QueueFull("Too many uploads in progress")
+
+    batch_jobs = [IngestJob(group_id=group_id, owner=owner, filename=filename, batched=True) for filename in filenames]
+    with _lock:
+        for job in batch_jobs:
+            _jobs[job.id] = job
+        _prune()
+    return batch_jobs
+
+
+def start_job(job: IngestJob, file_path: str, content_hash: str = None):
+    _executor.submit(_run, job, file_path, content_hash)
+
+
+def finish_duplicate(job: IngestJob, file_id: int, rows: int):
+    # The same statement was uploaded before; nothing to parse
+    job.file_id = file_id
+    job.rows_duplicate = rows
+    job.duplicate = True
+    job.status = "done"
+    _release(job)
+
+
+def fail_job(job: IngestJob, error: str):
+    job.status = "failed"
+    job.error = error
+    _release(job)
+
+
+def _release(job: IngestJob):
+    if not job.batched:
+        _pending.release()
+
+
+def get_job(job_id: str):
+    with _lock:
+        return _jobs.get(job_id)
+
+
+def _prune():
+    finished = [job_id for job_id, job in _jobs.items() if job.status in ("done", "failed")]
+    for job_id in finished[:max(0, len(finished) - INGEST_KEEP_FINISHED)]:
+        del _jobs[job_id]
+
+
+def _run(job: IngestJob, file_path: str, content_hash: str = None):
+    # The statement is opened here and its rows inserted by a write-queue
+    # job, like a batch of one, so the insert never holds the write lock
+    # against other writes. The pandas engine has parsed the whole file by
+    # the time read_statement returns; the stream engine parses as the
+    # writer consumes the rows, keeping memory flat.
+    job.status = "running"
+    reading = 0.0
+    try:
+        job.timings = {}
+        rows = read_statement(file_path, timings=job.timings)
+
+        def counted(rows):
+            # Time spent waiting on the rows is not insert time
+            nonlocal reading
+            rows = iter(rows)
+            while True:
+                start = time.perf_counter()
+                row = next(rows, None)
+                reading += time.perf_counter() - start
+                if row is None:
+                    return
+                job.rows_parsed += 1
+                yield row
+
+        [(_, error)] = write_queue.run(_insert_batch, [(job, content_hash, counted(rows))])
+        if 'insert' in job.timings:
+            job.timings['insert'] -= reading
+    except Exception as e:
+        logger.error(f"Error processing file {job.filename}: {str(e)}")
+        error = e
+    finally:
+        _pending.release()
+    _finish(job, error)
+
+
+def _process_pool():
+    # Started on first use. Workers are spawned rather than forked, as the
+    # server process already runs threads holding locks and connections.
+    global _processes
+    with _lock:
+        if _processes is None:
+            _processes = ProcessPoolExecutor(
+                max_workers=INGEST_PROCESSES, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _processes
+
+
+async def run_batch(batch):
+    # `batch` holds (job, file_path, content_hash) for each statement of a
+    # batch upload. They are parsed in parallel on the process pool, then
+    # every file is written by a single write-queue job, so the whole batch
+    # shares one commit. Each job still ends up done or failed on its own.
+    # Frees the batch's pending slot, also when `batch` is empty.
+    try:
+        await _run_batch(batch)
+    finally:
+        _pending.release()
+
+
+async def _run_batch(batch):
+    loop = asyncio.get_running_loop()
+    for job, _, _ in batch:
+        job.status = "running"
+    parsed = await asyncio.gather(
+        # Absolute paths, as the workers need not share our working directory
+        *(loop.run_in_executor(_process_pool(), parse_statement, os.path.abspath(file_path)) for _, file_path, _ in batch),
+        return_exceptions=True
+    )
+
+    ready = []
+    for (job, _, content_hash), result in zip(batch, parsed):
+        if isinstance(result, Exception):
+            logger.error(f"Error processing file {job.filename}: {str(result)}")
+            job.status = "failed"
+            job.error = str(result)
+            continue
+        rows, timings = result
+        job.rows_parsed = len(rows)
+        job.timings = timings
+        ready.append((job, content_hash, rows))
+
+    try:
+        outcomes = await write_queue.run_async(_insert_batch, ready) if ready else []
+    except Exception as e:
+        logger.error(f"Error committing batch upload: {str(e)}")
+        outcomes = [(job, e) for job, _, _ in ready]
+
+    for job, error in outcomes:
+        _finish(job, error)
+
+
+def _finish(job: IngestJob, error):
+    if error is not None:
+        job.rows_inserted = 0
+        job.rows_duplicate = 0
+        job.status = "failed"
+        job.error = str(error)
+        return
+    metrics.observe_ingest(job.timings)
+    metrics.INGEST_ROWS.inc(job.rows_inserted, result="inserted")
+    metrics.INGEST_ROWS.inc(job.rows_duplicate, result="duplicate")
+    job.timings = {stage: round(seconds, 4) for stage, seconds in job.timings.items()}
+    job.status = "done"
+
+
+def _insert_batch(db, ready):
+    # Runs on the writer thread; a file that fails is rolled back alone
+    outcomes = []
+    for job, content_hash, rows in ready:
+        try:
+            # Also catches the same statement twice in one batch
+            existing = crud.get_file_by_content_hash(db, job.group_id, job.owner, content_hash)
+            if existing:
+                job.file_id = existing.id
+                job.rows_duplicate = crud.count_file_transactions(db, existing.id)
+                job.duplicate = True
+            else:
+                def on_progress(count):
+                    job.rows_inserted += count
+
+                def on_duplicate(count):
+                    job.rows_duplicate += count
+
+                file_data = schemas.FileCreate(
+                    name=job.filename, group_id=job.group_id, owner=job.owner, content_hash=content_hash
+                )
+                start = time.perf_counter()
+                db_file = crud.create_file_with_transactions(
+                    db=db, file=file_data, rows=rows, on_progress=on_progress, on_duplicate=on_duplicate
+                )
+                job.timings["insert"] = time.perf_counter() - start
+                job.file_id = db_file.id
+            outcomes.append((job, None))
+        except Exception as e:
+            logger.error(f"Error processing file {job.filename}: {str(e)}")
+            outcomes.append((job, e))
+    return outcomes
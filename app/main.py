@@ -1,18 +1,23 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Request, Form
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Request, Form, Query, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List, Dict
-from . import crud, models, schemas
-from .database import SessionLocal, engine
+from typing import List, Dict, Optional
+from . import archive, cache, crud, export, jobs, metrics, migrations, models, schemas, settlement, sync
+from .writer import write_queue
+from .database import AsyncSessionLocal, SessionLocal, engine
+from .ingest import UPLOAD_CHUNK_SIZE
 from fastapi.middleware.cors import CORSMiddleware
 import aiofiles
+import hashlib
 import os
-import pandas as pd
+import json
 import logging
 
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
 logger = logging.getLogger(__name__)
 
-models.Base.metadata.create_all(bind=engine)
+migrations.upgrade(engine)
 
 app = FastAPI()
 
@@ -32,6 +37,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so the time CORS and error handling take is counted too
+app.add_middleware(metrics.MetricsMiddleware)
+
 def get_db():
     db = SessionLocal()
     try:
@@ -39,49 +47,20 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
 
-def translate_headers(df):
-    bank_headers = {
-        'Chase': {
-            'Transaction Date': 'Transaction_Date', 
-            'Post Date': 'Post_Date', 
-            'Description': 'Description',
-            'Category': 'Category', 
-            'Type': 'Budget', 
-            'Amount': 'Amount', 
-            'Memo': 'Memo'
-        },
-        'US Bank': {
-            'Date': 'Transaction_Date',    
-            'Transaction': 'Type', 
-            'Name': 'Description', 
-            'Memo': 'Memo', 
-            'Amount': 'Amount'
-        },
-        'AMEX': {
-            'Date': 'Transaction_Date',  
-            'Description': 'Description',
-            'Amount': 'Amount'
-        },
-        'Wells Fargo': {
-            'Date': 'Transaction_Date',  
-            'Description': 'Description',
-            'Empty1': 'Empty1',
-            'Empty2': 'Empty2',
-            'Amount': 'Amount'
-        }
-    }
 
-    for bank, headers in bank_headers.items():
-        if set(headers.keys()).issubset(set(df.columns)):
-            df = df.rename(columns=headers)
+def ensure_hot(group):
+    # Transactions of archived or settled groups sit in their archive file
+    # and cannot be changed until the group is restored or unsettled
+    if group.cold_storage:
+        raise HTTPException(status_code=409, detail="Group is archived or settled; restore it to make changes")
 
-            if bank == 'AMEX':
-                df['Amount'] = df['Amount'] * -1
-                
-            return df
-    
-    return None
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/")
 async def root():
@@ -92,33 +71,28 @@ def create_group(group: schemas.UserGroupCreate, db: Session = Depends(get_db)):
     db_group = crud.get_group_by_name(db, name=group.name)
     if db_group:
         raise HTTPException(status_code=400, detail="Group already registered")
-    return crud.create_group(db=db, group=group)
+    db_group = write_queue.run(crud.create_group, group)
+    return crud.get_group(db, db_group.id)
+
+@app.post("/groups/{group_id}/members", response_model=schemas.UserGroup)
+def add_group_member(group_id: int, member: schemas.GroupMemberCreate, db: Session = Depends(get_db)):
+    if not write_queue.run(crud.add_group_member, group_id, member.name):
+        raise HTTPException(status_code=404, detail="Group not found")
+    return crud.get_group(db, group_id)
 
 @app.get("/groups/balances", response_model=List[schemas.GroupBalance])
-def get_group_balances(db: Session = Depends(get_db)):
-    # Fetch all groups
-    groups = crud.get_groups(db)
+def get_group_balances(request: Request, db: Session = Depends(get_db)):
+    return cache.cached_response(request, crud.get_revision(db), lambda: (build_group_balances(db), {}))
+
+def build_group_balances(db: Session):
+    # Fetch all groups with their balances in one query
+    rows = crud.get_group_balances(db)
     
-    if not groups:
+    if not rows:
         raise HTTPException(status_code=404, detail="No groups found")
     
-    group_balances = []
-    
-    # Iterate over each group to calculate balances
-    for group in groups:
-        balance_person1 = 0
-        balance_person2 = 0
-
-        # Get all files for the current group
-        files = crud.get_files_by_group_id(db, group_id=group.id)
-
-        # Sum the balances from the files
-        for file in files:
-            balance_person1 += file.balance_person1
-            balance_person2 += file.balance_person2
-
-        # Create a GroupBalance schema and add it to the list
-        group_balance = schemas.GroupBalance(
+    return cache.encode(List[schemas.GroupBalance], [
+        schemas.GroupBalance(
             id=group.id,
             name=group.name, 
             person1=group.person1, 
@@ -126,135 +100,341 @@ def get_group_balances(db: Session = Depends(get_db)):
             balance_person1=balance_person1, 
             balance_person2=balance_person2
         )
-        group_balances.append(group_balance)
-
-    # Return the list of group balances
-    return group_balances
+        for group, balance_person1, balance_person2 in rows
+    ])
 
 @app.get("/groups/{group_id}", response_model=schemas.UserGroup)
-def read_group(group_id: int, db: Session = Depends(get_db)):
-    db_group = crud.get_group(db, group_id=group_id)
-    if db_group is None:
-        raise HTTPException(status_code=404, detail="Group not found")
-    return db_group
+def read_group(group_id: int, request: Request, db: Session = Depends(get_db)):
+    def build():
+        db_group = crud.get_group(db, group_id=group_id)
+        if db_group is None:
+            raise HTTPException(status_code=404, detail="Group not found")
+        return cache.encode(schemas.UserGroup, db_group), {}
+    return cache.cached_response(request, crud.get_group_revision(db, group_id), build)
 
 @app.get("/groups/", response_model=List[schemas.UserGroup])
-def read_groups(skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
-    groups = db.query(models.UserGroup).filter(models.UserGroup.is_hidden == False).offset(skip).limit(limit).all()
-    return groups
+def read_groups(request: Request, skip: int = 0, limit: int = 10, db: Session = Depends(get_db)):
+    def build():
+        groups = db.query(models.UserGroup).filter(models.UserGroup.is_hidden == False).offset(skip).limit(limit).all()
+        return cache.encode(List[schemas.UserGroup], groups), {}
+    return cache.cached_response(request, crud.get_revision(db), build)
 
 @app.get("/groups/{group_id}/files", response_model=List[schemas.File])
-def read_files_for_group(group_id: int, db: Session = Depends(get_db)):
+def read_files_for_group(group_id: int, request: Request, db: Session = Depends(get_db)):
+    def build():
+        db_group = crud.get_group(db, group_id=group_id)
+        if db_group is None:
+            raise HTTPException(status_code=404, detail="Group not found")
+        result = crud.get_file_rows(db, group_id=group_id)
+        return cache.encode_rows(result.keys(), result), {}
+    return cache.cached_response(request, crud.get_group_revision(db, group_id), build)
+
+@app.get("/groups/{group_id}/summary", response_model=schemas.GroupSummary)
+def read_group_summary(group_id: int,
+                       request: Request,
+                       month_from: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$"),
+                       month_to: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$"),
+                       db: Session = Depends(get_db)):
+    # Spend by month, action and owner, read from buckets kept up to date
+    # on every write, so the cost does not grow with the transactions
+    def build():
+        db_group = crud.get_group(db, group_id=group_id)
+        if db_group is None:
+            raise HTTPException(status_code=404, detail="Group not found")
+        summary = crud.get_group_summary(db, group_id, month_from=month_from, month_to=month_to)
+        return cache.encode(schemas.GroupSummary, summary), {}
+    return cache.cached_response(request, crud.get_group_revision(db, group_id), build)
+
+@app.get("/groups/{group_id}/export")
+def export_group(group_id: int,
+                 format: str = Query("csv", pattern="^(csv|parquet|ndjson)$"),
+                 date_from: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}-\d{2}$"),
+                 date_to: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}-\d{2}$"),
+                 action: Optional[List[str]] = Query(None),
+                 db: Session = Depends(get_db)):
     db_group = crud.get_group(db, group_id=group_id)
     if db_group is None:
         raise HTTPException(status_code=404, detail="Group not found")
-    return crud.get_files_by_group_id(db, group_id=group_id)
+
+    encode, media_type = export.FORMATS[format]
+    rows = export.iter_rows(group_id, db_group.cold_storage, date_from=date_from, date_to=date_to, actions=action)
+    return StreamingResponse(
+        encode(rows),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="group_{group_id}.{format}"'}
+    )
 
 @app.get("/files/{file_id}", response_model=schemas.File)
-def read_file(file_id: int, db: Session = Depends(get_db)):
-    db_file = db.query(models.File).filter(models.File.id == file_id).first()
-    if db_file is None:
-        raise HTTPException(status_code=404, detail="File not found")
-    return db_file
+def read_file(file_id: int, request: Request, db: Session = Depends(get_db)):
+    def build():
+        db_file = db.query(models.File).filter(models.File.id == file_id).first()
+        if db_file is None:
+            raise HTTPException(status_code=404, detail="File not found")
+        return cache.encode(schemas.File, db_file), {}
+    return cache.cached_response(request, crud.get_file_revision(db, file_id), build)
 
 @app.get("/files/{file_id}/transactions", response_model=List[schemas.Transaction])
-def read_transactions_for_file(file_id: int, db: Session = Depends(get_db)):
-    db_file = db.query(models.File).filter(models.File.id == file_id).first()
-    if db_file is None:
-        raise HTTPException(status_code=404, detail="File not found")
-    return crud.get_transactions_by_file_id(db, file_id=file_id)
+def read_transactions_for_file(file_id: int,
+                               request: Request,
+                               after_id: Optional[int] = None,
+                               limit: Optional[int] = Query(None, ge=1, le=10000),
+                               format: str = Query("json", pattern="^(json|ndjson)$"),
+                               db: Session = Depends(get_db)):
+    if format == "ndjson":
+        db_file = db.query(models.File).filter(models.File.id == file_id).first()
+        if db_file is None:
+            raise HTTPException(status_code=404, detail="File not found")
+
+        if db_file.group.cold_storage:
+            group_id = db_file.group_id
+            def stream():
+                for batch in archive.iter_transaction_batches(group_id, file_id):
+                    yield "".join(json.dumps(row) + "\n" for row in batch)
+            return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+        # Rows are read in keyset batches on a session of their own, since
+        # the body is produced after this handler returns
+        def stream():
+            with SessionLocal() as stream_db:
+                for batch in crud.iter_transaction_batches(stream_db, file_id=file_id):
+                    yield "".join(
+                        json.dumps({**row._asdict(), "amount": None if row.amount is None else float(row.amount)}) + "\n"
+                        for row in batch
+                    )
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    def build():
+        db_file = db.query(models.File).filter(models.File.id == file_id).first()
+        if db_file is None:
+            raise HTTPException(status_code=404, detail="File not found")
+
+        if limit is None and after_id is None:
+            if db_file.group.cold_storage:
+                return cache.encode_rows(*archive.get_transaction_rows(db_file.group_id, file_id)), {}
+            result = crud.get_transaction_rows(db, file_id=file_id)
+            return cache.encode_rows(result.keys(), result), {}
+
+        if db_file.group.cold_storage:
+            keys, transactions = archive.get_transaction_rows(db_file.group_id, file_id, after_id=after_id, limit=limit or 100)
+        else:
+            result = crud.get_transaction_rows(db, file_id=file_id, after_id=after_id, limit=limit or 100)
+            keys, transactions = result.keys(), result.all()
+
+        headers = {}
+        if len(transactions) == (limit or 100):
+            headers["X-Next-Cursor"] = str(transactions[-1][list(keys).index("id")])
+        return cache.encode_rows(keys, transactions), headers
+    return cache.cached_response(request, crud.get_file_revision(db, file_id), build)
 
 @app.post("/files/{file_id}/transactions", response_model=List[schemas.Transaction])
 def create_transactions_for_file(file_id: int, transactions: List[schemas.TransactionCreate], db: Session = Depends(get_db)):
     db_file = db.query(models.File).filter(models.File.id == file_id).first()
     if db_file is None:
         raise HTTPException(status_code=404, detail="File not found")
-
-    db_transactions = [crud.create_transaction(db=db, transaction=transaction, file_id=file_id) for transaction in transactions]
-    return db_transactions
+    ensure_hot(db_file.group)
+
+    transactions = [transaction.model_copy(update={'file_id': file_id}) for transaction in transactions]
+    return write_queue.run(crud.upsert_transactions, transactions)
+
+@app.get("/transactions/search", response_model=schemas.SearchResults)
+def search_transactions(request: Request,
+                        q: str = Query(..., min_length=1),
+                        group_id: Optional[int] = None,
+                        owner: Optional[str] = None,
+                        date_from: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}-\d{2}$"),
+                        date_to: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}-\d{2}$"),
+                        order: str = Query("rank", pattern="^(rank|recent)$"),
+                        cursor: Optional[str] = None,
+                        limit: int = Query(50, ge=1, le=500),
+                        db: Session = Depends(get_db)):
+    # Full-text search over the descriptions of hot groups' transactions,
+    # every word matching as a prefix; best matches first, or newest first
+    # with order=recent. The cursor is 'rank:id' or 'id' respectively.
+    after_rank = after_id = None
+    if cursor is not None:
+        rank, _, last_id = cursor.rpartition(":")
+        try:
+            after_id = int(last_id)
+            if order == "rank":
+                after_rank = float(rank)
+        except ValueError:
+            raise HTTPException(status_code=422, detail="Invalid cursor")
+
+    def build():
+        rows = crud.search_transactions(
+            db, q, group_id=group_id, owner=owner, date_from=date_from, date_to=date_to,
+            order=order, after_rank=after_rank, after_id=after_id, limit=limit
+        )
+        results = [{**row._asdict(), 'score': -row.rank} for row in rows]
+        next_cursor = None
+        if len(rows) == limit:
+            last = rows[-1]
+            next_cursor = f"{last.rank!r}:{last.id}" if order == "rank" else str(last.id)
+        return cache.encode(schemas.SearchResults, {'results': results, 'next_cursor': next_cursor}), {}
+    return cache.cached_response(request, crud.get_revision(db), build)
 
 @app.get("/transactions/{transaction_id}", response_model=schemas.Transaction)
 def read_transaction(transaction_id: int, db: Session = Depends(get_db)):
     db_transaction = db.query(models.Transaction).filter(models.Transaction.id == transaction_id).first()
+    if db_transaction is None:
+        db_transaction = archive.find_transaction(db, transaction_id)
     if db_transaction is None:
         raise HTTPException(status_code=404, detail="Transaction not found")
     return db_transaction
 
-@app.post("/groups/{group_id}/upload", response_model=schemas.File)
+@app.post("/groups/{group_id}/upload", response_model=schemas.IngestJob, status_code=202)
 async def upload_file(group_id: int, 
+                      response: Response,
                       owner: str = Form(...),  # Capture the owner from the form data
                       file: UploadFile = File(...), 
-                      db: Session = Depends(get_db)):
+                      db: AsyncSession = Depends(get_async_db)):
     
     # Fetch the group from the database
-    group = crud.get_group(db, group_id=group_id)
+    group = await db.run_sync(crud.get_group, group_id)
 
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
+    ensure_hot(group)
 
-    # Save file to disk or process it in-memory
-    upload_dir = "uploads"
-    os.makedirs(upload_dir, exist_ok=True)
-    file_path = os.path.join(upload_dir, f"{group_id}_{file.filename}")
-
-    async with aiofiles.open(file_path, 'wb') as out_file:
-        content = await file.read()
-        await out_file.write(content)
+    try:
+        job = jobs.create_job(group_id=group_id, owner=owner, filename=file.filename)
+    except jobs.QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
 
-    # Read the file to process transactions
+    # Save file to disk, parsing happens on the ingest workers
+    file_path = upload_path(group_id, job, file)
     try:
-        df = pd.read_csv(file_path)
-        logger.debug(f"CSV DataFrame before translation: {df.head()}")
-        df = translate_headers(df)
-        if df is None:
-            logger.error("Unsupported bank")
-            raise HTTPException(status_code=400, detail="Unsupported bank")
-        logger.debug(f"CSV DataFrame after translation: {df.head()}")
+        content_hash = await save_upload(file, file_path)
     except Exception as e:
-        logger.error(f"Error processing file: {str(e)}")
-        raise HTTPException(status_code=400, detail=f"Error processing file: {str(e)}")
-
-    # Create a new file record in the database
-    file_data = schemas.FileCreate(name=file.filename, group_id=group_id, owner=owner)
-    db_file = crud.create_file(db=db, file=file_data)
-    print('FILE ID: ', db_file.id)
-    transactions = []  # Initialize the transactions list
-    
+        logger.error(f"Error saving file: {str(e)}")
+        jobs.fail_job(job, f"Error saving file: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error saving file: {str(e)}")
+
     try:
-        # Use the created file ID to associate transactions
-        for index, row in df.iterrows():
-            transaction = schemas.TransactionCreate(
-                date=row['Transaction_Date'],
-                description=row['Description'],
-                amount=row['Amount'],
-                action='Ignore',  # Use the correct field name
-                file_id=db_file.id,  # Ensure file_id is included
-                owner=owner,
-                previous_action=''
-            )
-            transactions.append(crud.create_transaction(db=db, transaction=transaction))
+        existing = await find_previous_upload(db, group_id, owner, content_hash)
     except Exception as e:
-        logger.error(f"Error creating transactions: {str(e)}")
-        raise HTTPException(status_code=400, detail=f"Error creating transactions: {str(e)}")
-    
-    return db_file
+        logger.error(f"Error looking up previous uploads: {str(e)}")
+        os.remove(file_path)
+        jobs.fail_job(job, f"Error looking up previous uploads: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error looking up previous uploads: {str(e)}")
+    if existing:
+        os.remove(file_path)
+        jobs.finish_duplicate(job, *existing)
+        response.status_code = 200
+        return job
+
+    jobs.start_job(job, file_path, content_hash)
+    return job
+
+@app.post("/groups/{group_id}/upload/batch", response_model=List[schemas.IngestJob])
+async def upload_files(group_id: int,
+                       owner: str = Form(...),
+                       files: List[UploadFile] = File(...),
+                       db: AsyncSession = Depends(get_async_db)):
+    # Many statements in one request, parsed in parallel and committed
+    # together; answers once all are done, with a job per file
+    group = await db.run_sync(crud.get_group, group_id)
+
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    ensure_hot(group)
+
+    try:
+        batch_jobs = jobs.create_batch_jobs(group_id, owner, [file.filename for file in files])
+    except jobs.QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    batch = []
+    for job, file in zip(batch_jobs, files):
+        file_path = upload_path(group_id, job, file)
+        try:
+            content_hash = await save_upload(file, file_path)
+        except Exception as e:
+            logger.error(f"Error saving file: {str(e)}")
+            jobs.fail_job(job, f"Error saving file: {str(e)}")
+            continue
+
+        try:
+            existing = await find_previous_upload(db, group_id, owner, content_hash)
+        except Exception as e:
+            logger.error(f"Error looking up previous uploads: {str(e)}")
+            os.remove(file_path)
+            jobs.fail_job(job, f"Error looking up previous uploads: {str(e)}")
+            continue
+        if existing:
+            os.remove(file_path)
+            jobs.finish_duplicate(job, *existing)
+            continue
+        batch.append((job, file_path, content_hash))
+
+    await jobs.run_batch(batch)
+    return batch_jobs
+
+def upload_path(group_id: int, job, file: UploadFile):
+    return os.path.join("uploads", f"{group_id}_{job.id}_{file.filename}")
+
+async def find_previous_upload(db: AsyncSession, group_id: int, owner: str, content_hash: str):
+    # (file id, row count) of the file this statement was uploaded as before
+    existing = await db.run_sync(crud.get_file_by_content_hash, group_id, owner, content_hash)
+    if existing is None:
+        return None
+    return existing.id, await db.run_sync(crud.count_file_transactions, existing.id)
+
+async def save_upload(file: UploadFile, file_path: str):
+    # Hashed while it streams in, so a re-upload is found by lookup
+    content_hash = hashlib.sha256()
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    async with aiofiles.open(file_path, 'wb') as out_file:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            content_hash.update(chunk)
+            await out_file.write(chunk)
+    return content_hash.hexdigest()
+
+@app.get("/sync", response_model=schemas.SyncChanges)
+def read_changes(since: int = Query(0, ge=0),
+                 after_id: Optional[int] = Query(None, ge=0),
+                 limit: int = Query(sync.SYNC_PAGE_ROWS, ge=1, le=50000),
+                 db: Session = Depends(get_db)):
+    # Groups, files and transactions changed after revision `since`, and
+    # files deleted since; `since=0` returns everything
+    return sync.changes(db, since, after_id=after_id, limit=limit)
+
+@app.get("/sync/events")
+async def sync_events(request: Request, since: int = Query(0, ge=0)):
+    # Server-sent events carrying the current revision whenever it moves
+    # past `since` (or the Last-Event-ID a reconnecting browser sends)
+    last_event_id = request.headers.get("last-event-id", "")
+    if last_event_id.isdigit():
+        since = int(last_event_id)
+
+    async def stream():
+        async for rev in sync.feed.watch(since):
+            if rev is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"id: {rev}\nevent: revision\ndata: {json.dumps({'rev': rev})}\n\n"
+
+    return StreamingResponse(
+        stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/jobs/{job_id}", response_model=schemas.IngestJob)
+def read_job(job_id: str):
+    job = jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 
 @app.post("/groups/{group_id}/transactions", response_model=List[schemas.Transaction])
-async def save_transactions(group_id: int, transactions_data: List[schemas.TransactionCreate], db: Session = Depends(get_db)):
-    group = crud.get_group(db, group_id=group_id)
+async def save_transactions(group_id: int, transactions_data: List[schemas.TransactionCreate], db: AsyncSession = Depends(get_async_db)):
+    group = await db.run_sync(crud.get_group, group_id)
     
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
+    ensure_hot(group)
 
-    processed_transactions = []
-
-    for transaction in transactions_data:
-        # Use the new create_or_update_transaction function
-        processed_transaction = crud.create_or_update_transaction(db=db, transaction=transaction)
-        processed_transactions.append(processed_transaction)
-
-    return processed_transactions
+    return await write_queue.run_async(crud.upsert_transactions, transactions_data)
 
 @app.post("/files/{file_id}/balances", response_model=schemas.File)
 def update_file_balances(file_id: int, balances: schemas.FileBalanceUpdate, db: Session = Depends(get_db)):
@@ -264,51 +444,47 @@ def update_file_balances(file_id: int, balances: schemas.FileBalanceUpdate, db:
     if not db_file:
         raise HTTPException(status_code=404, detail="File not found")
     
-    # Update the balances
-    db_file.balance_person1 = balances.balance_person1
-    db_file.balance_person2 = balances.balance_person2
+    # Update the balances together with the group totals
+    db_file = write_queue.run(
+        lambda write_db: crud.update_file_balances(db=write_db, db_file=crud.get_file(write_db, file_id), balances=balances)
+    )
+    return db_file
+
+@app.post("/files/{file_id}/balances/recompute", response_model=schemas.File)
+def recompute_file_balances(file_id: int, db: Session = Depends(get_db)):
+    db_file = crud.get_file(db=db, file_id=file_id)
     
-    # Commit the changes to the database
-    db.commit()
-    db.refresh(db_file)
+    if not db_file:
+        raise HTTPException(status_code=404, detail="File not found")
+    ensure_hot(db_file.group)
     
+    db_file = write_queue.run(
+        lambda write_db: crud.recompute_file_balances(db=write_db, db_file=crud.get_file(write_db, file_id))
+    )
     return db_file
 
 @app.get("/groups/{group_id}/balance", response_model=schemas.GroupBalance)
-def get_group_balance(group_id: int, db: Session = Depends(get_db)):
-    group = crud.get_group(db, group_id=group_id)
-    if group is None:
-        raise HTTPException(status_code=404, detail="Group not found")
-    
-    balance_person1 = 0
-    balance_person2 = 0
-
-    files = crud.get_files_by_group_id(db, group_id=group_id)
-    for file in files:
-        balance_person1 += file.balance_person1
-        balance_person2 += file.balance_person2
-
-    return schemas.GroupBalance(id=group_id, balance_person1=balance_person1, balance_person2=balance_person2)
+def get_group_balance(group_id: int, request: Request, db: Session = Depends(get_db)):
+    def build():
+        rows = crud.get_group_balances(db, group_id=group_id)
+        if not rows:
+            raise HTTPException(status_code=404, detail="Group not found")
+        
+        group, balance_person1, balance_person2 = rows[0]
+        return cache.encode(schemas.GroupBalance, schemas.GroupBalance(
+            id=group.id,
+            name=group.name,
+            person1=group.person1,
+            person2=group.person2,
+            balance_person1=balance_person1,
+            balance_person2=balance_person2
+        )), {}
+    return cache.cached_response(request, crud.get_group_revision(db, group_id), build)
 
 
 @app.post("/transactions/query-actions")
-async def query_past_actions(request: schemas.QueryActionsRequest, db: Session = Depends(get_db)):
-    descriptions = request.descriptions
-    owner = request.owner
-
-    results = {}
-    for description in descriptions:
-        # Query the most recent action for this description
-        transaction = (
-            db.query(models.Transaction)
-            .filter(models.Transaction.description == description)
-            .filter(models.Transaction.owner == owner)
-            .order_by(models.Transaction.date.desc())
-            .first()
-        )
-        if transaction:
-            results[description] = transaction.action
-    return results
+async def query_past_actions(request: schemas.QueryActionsRequest, db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(crud.get_last_actions, request.owner, request.descriptions)
 
 @app.delete("/groups/{group_id}/files/{file_id}")
 def delete_file(group_id: int, file_id: int, db: Session = Depends(get_db)):
@@ -317,113 +493,86 @@ def delete_file(group_id: int, file_id: int, db: Session = Depends(get_db)):
     
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
+    ensure_hot(file.group)
     
-    # Delete associated transactions
-    db.query(models.Transaction).filter(models.Transaction.file_id == file.id).delete()
-
-    # Delete the file
-    db.delete(file)
-    db.commit()
+    # Delete the file and its transactions
+    write_queue.run(lambda write_db: crud.delete_file(write_db, crud.get_file(write_db, file.id)))
 
     return {"detail": "File and associated transactions deleted successfully"}
 
 @app.put("/groups/{group_id}/hide")
-async def hide_group(group_id: int, db: Session = Depends(get_db)):
-    group = crud.get_group(db, group_id)
+async def hide_group(group_id: int):
+    group = await write_queue.run_async(crud.update_group, group_id, is_hidden=True)  # Set the flag to hide the group
     
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
-    else:
-        group.is_hidden = True  # Set the flag to hide the group
-        db.commit()
-        # db.refresh(group)
     
-        return {"message": "Group hidden successfully"}
+    return {"message": "Group hidden successfully"}
 
 @app.patch("/groups/{group_id}/archive")
-async def archive_group(group_id: int, db: Session = Depends(get_db)):
+async def archive_group(group_id: int):
 
-    group = crud.get_group(db, group_id)
+    group = await write_queue.run_async(archive.update_group, group_id, is_archived=True)
     
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
-    
-    group.is_archived = True  # Set the flag to hide the group
-    
-    db.commit()
-    # db.refresh(group)
 
     return {"message": "Group archived successfully"}
 
 @app.patch("/groups/{group_id}/restore")
-async def archive_group(group_id: int, db: Session = Depends(get_db)):
-
-    # body = request.json()  # This reads and parses the body as JSON
-    # print(f"Request Body: {body}") 
+async def archive_group(group_id: int):
 
-    group = crud.get_group(db, group_id)
+    try:
+        group = await write_queue.run_async(archive.update_group, group_id, is_archived=False)
+    except archive.RestoreConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
     
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
-    
-    group.is_archived = False  # Set the flag to hide the group
-    
-    db.commit()
-    # db.refresh(group)
+    if not group.cold_storage:
+        # The rows are back in SQLite now that the move has committed
+        archive.remove_archive(group_id)
 
     return {"message": "Group restored successfully"}
 
-@app.patch("/groups/{group_id}/settle")
-async def settle_group(group_id: int, db: Session = Depends(get_db)):
+@app.get("/groups/{group_id}/settlement", response_model=schemas.Settlement)
+def preview_settlement(group_id: int, db: Session = Depends(get_db)):
     group = crud.get_group(db, group_id)
-    
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
-    
-    # files = crud.get_files_by_group_id(group_id)
-    
-    # group_balance_person1 = 0
-    # group_balance_person2 = 0
+    return settlement.plan(group, db)
 
-    # for file in files:
-    #     balance_person1 += file.balance_person1
-    #     balance_person2 += file.balance_person2
-    
-    # settle_amount = group_balance_person1 - group_balance_person2
+@app.patch("/groups/{group_id}/settle")
+async def settle_group(group_id: int, db: AsyncSession = Depends(get_async_db)):
+    group = await db.run_sync(crud.get_group, group_id)
     
-    # if settle_amount < 0:
-        # the determine who owes who
-
-    # settle_description = f"Settle Balance for Group {group.name}"
-
-    # # Create a transaction to settle the balance
-    # settle_transaction = models.Transaction(
-    #     group_id=group.id,
-    #     description=settle_description,
-    #     amount=total_balance,
-    #     transaction_type="settle"
-    # )
-
-    # will need to create a file to add the settled transaction
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    ensure_hot(group)
 
-    # db.add(settle_transaction)
+    # Pays off every member's balance with settlement transactions
+    group, transfers = await write_queue.run_async(settlement.settle_group, group_id)
     
-    group.is_settled = True
-    db.commit()
-    db.refresh(group)
-    
-    return {"message": "Group settled successfully", "group": group}
+    return {
+        "message": "Group settled successfully",
+        "group": group,
+        "transfers": [
+            {"debtor": debtor, "creditor": creditor, "amount": amount} for debtor, creditor, amount in transfers
+        ]
+    }
 
 # Unsettle a Group
 @app.patch("/groups/{group_id}/unsettle")
-async def unsettle_group(group_id: int, db: Session = Depends(get_db)):
-    group = crud.get_group(db, group_id)
+async def unsettle_group(group_id: int):
+    try:
+        group = await write_queue.run_async(archive.update_group, group_id, is_settled=False)
+    except archive.RestoreConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
     
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
-    
-    group.is_settled = False
-    db.commit()
-    db.refresh(group)
+    if not group.cold_storage:
+        # The rows are back in SQLite now that the move has committed
+        archive.remove_archive(group_id)
     
     return {"message": "Group unsettled successfully", "group": group}
\ No newline at end of file
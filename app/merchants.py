@@ -0,0 +1,127 @@
+import functools
+import os
+import re
+import threading
+from collections import Counter
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import models
+
+# Suggested actions for new rows, learned per owner from the actions they
+# gave earlier transactions. Descriptions are reduced to merchant tokens and
+# kept in a prefix trie whose nodes count the actions of every description
+# passing through them, so 'COSTCO WHSE #0123' and 'COSTCO WHSE #0871' share
+# a node. 'Ignore' is the default for unreviewed rows and is not learned.
+SUGGEST_MIN_CONFIDENCE = float(os.getenv("SUGGEST_MIN_CONFIDENCE", "0.6"))
+MAX_TOKENS = 4
+UNLEARNED_ACTIONS = (None, '', 'Ignore')
+
+# Words are runs of letters, digits, '&' and "'"; only those without a digit count
+_WORDS = re.compile(r"(?<![A-Z0-9&'])[A-Z&']+(?![A-Z0-9&'])")
+
+
+@functools.lru_cache(maxsize=65536)
+def merchant_tokens(description: str):
+    # Upper-cased words without store numbers, dates and reference codes:
+    # 'UBER   *TRIP 8KD2JX4QZ' -> ('UBER', 'TRIP')
+    return tuple(_WORDS.findall((description or '').upper())[:MAX_TOKENS])
+
+
+class _Node:
+    __slots__ = ('children', 'counts')
+
+    def __init__(self):
+        self.children = {}
+        self.counts = Counter()
+
+
+class MerchantIndex:
+    def __init__(self):
+        self.root = _Node()
+
+    def add(self, description: str, action: str, weight: int = 1):
+        if action in UNLEARNED_ACTIONS:
+            return
+        node = self.root
+        for token in merchant_tokens(description):
+            node = node.children.setdefault(token, _Node())
+            node.counts[action] += weight
+            if node.counts[action] <= 0:
+                del node.counts[action]
+
+    def predict(self, tokens):
+        # Majority action of the deepest node the tokens reach, if it is
+        # clear enough; None when not even the first token is known
+        node, deepest = self.root, None
+        for token in tokens:
+            node = node.children.get(token)
+            if node is None:
+                break
+            if node.counts:
+                deepest = node
+        if deepest is None:
+            return None
+        action, count = deepest.counts.most_common(1)[0]
+        if count / sum(deepest.counts.values()) < SUGGEST_MIN_CONFIDENCE:
+            return None
+        return action
+
+
+# owner -> MerchantIndex, built on first use
+_indexes = {}
+_lock = threading.Lock()
+
+
+def _build(db: Session, owner: str):
+    index = MerchantIndex()
+    Transaction = models.Transaction
+    rows = db.execute(
+        select(Transaction.description, Transaction.action)
+        .where(Transaction.owner == owner, Transaction.action.notin_(('', 'Ignore')))
+    )
+    for description, action in rows:
+        index.add(description, action)
+    return index
+
+
+def get_index(db: Session, owner: str):
+    with _lock:
+        index = _indexes.get(owner)
+        if index is None:
+            index = _indexes[owner] = _build(db, owner)
+        return index
+
+
+def suggest_actions(db: Session, owner: str, descriptions):
+    # One prediction per distinct merchant, spread back over the rows
+    if not descriptions:
+        return []
+    index = get_index(db, owner)
+    keys = np.array([" ".join(merchant_tokens(description)) for description in descriptions], dtype=object)
+    merchants, inverse = np.unique(keys.astype(str), return_inverse=True)
+    with _lock:
+        predictions = np.array([index.predict(merchant.split()) for merchant in merchants], dtype=object)
+    return predictions[inverse.reshape(-1)].tolist()
+
+
+def record_actions(owner: str, changes):
+    # Fold confirmed actions into a loaded index; `changes` holds
+    # (description, old action, new action) with None for new rows
+    with _lock:
+        index = _indexes.get(owner)
+        if index is None:
+            return
+        for description, old, new in changes:
+            if old == new:
+                continue
+            index.add(description, old, -1)
+            index.add(description, new)
+
+
+def forget(owner: str):
+    # Drop an owner's index so it is rebuilt from what the table holds now
+    with _lock:
+        _indexes.pop(owner, None)
@@ -0,0 +1,261 @@
+import logging
+from collections import Counter
+
+from sqlalchemy import MetaData, inspect, select, text
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from . import archive, crud, formats, models
+
+logger = logging.getLogger(__name__)
+
+# Ordered schema migrations, applied once each and recorded by name in
+# schema_migrations. 0001 builds the current schema for a new database with
+# create_all, so every later migration must also be safe to run against a
+# schema that already has its change.
+MIGRATIONS = []
+
+
+def migration(fn):
+    MIGRATIONS.append(fn)
+    return fn
+
+
+def upgrade(engine):
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "name VARCHAR PRIMARY KEY, "
+            "applied_at DATETIME DEFAULT CURRENT_TIMESTAMP)"
+        ))
+        applied = set(connection.execute(text("SELECT name FROM schema_migrations")).scalars())
+
+    for fn in MIGRATIONS:
+        if fn.__name__ in applied:
+            continue
+        logger.info(f"Applying migration {fn.__name__}")
+        with engine.begin() as connection:
+            fn(connection)
+            connection.execute(text("INSERT INTO schema_migrations (name) VALUES (:name)"), {"name": fn.__name__})
+
+
+def _create_missing_indexes(connection, table):
+    # Indexes on columns a later migration adds are left for that migration
+    columns = {column['name'] for column in inspect(connection).get_columns(table.name)}
+    for index in table.indexes:
+        if all(column.name in columns for column in index.columns):
+            # IF NOT EXISTS rather than checkfirst, which cannot see expression indexes
+            connection.execute(CreateIndex(index, if_not_exists=True))
+
+
+def _add_missing_column(connection, table_name: str, column_name: str, ddl_type: str):
+    columns = {column['name'] for column in inspect(connection).get_columns(table_name)}
+    if column_name not in columns:
+        connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {ddl_type}"))
+
+
+@migration
+def m0001_initial_schema(connection):
+    # Databases created before migrations existed already have the base
+    # tables; only the derived tables are new to them and need a backfill
+    existing_tables = set(inspect(connection).get_table_names())
+    models.Base.metadata.create_all(bind=connection)
+    _create_missing_indexes(connection, models.Transaction.__table__)
+
+    if models.GroupBalance.__tablename__ not in existing_tables:
+        with Session(bind=connection) as db:
+            crud.rebuild_group_balances(db)
+
+
+@migration
+def m0002_transaction_iso_date(connection):
+    _add_missing_column(connection, 'transactions', 'iso_date', 'VARCHAR')
+
+    after_id = 0
+    while True:
+        rows = connection.execute(
+            text("SELECT id, date FROM transactions WHERE id > :after_id AND iso_date IS NULL ORDER BY id LIMIT 10000"),
+            {"after_id": after_id}
+        ).all()
+        if not rows:
+            break
+        updates = [
+            {"id": row.id, "iso_date": formats.sortable_date(row.date)}
+            for row in rows
+        ]
+        connection.execute(text("UPDATE transactions SET iso_date = :iso_date WHERE id = :id"), updates)
+        after_id = rows[-1].id
+
+    # "Latest" is now decided on iso_date instead of the raw date string
+    connection.execute(text("DELETE FROM last_actions"))
+    with Session(bind=connection) as db:
+        crud.rebuild_last_actions(db)
+
+
+@migration
+def m0003_covering_indexes(connection):
+    _create_missing_indexes(connection, models.File.__table__)
+    _create_missing_indexes(connection, models.Transaction.__table__)
+
+
+@migration
+def m0004_upload_fingerprints(connection):
+    _add_missing_column(connection, 'files', 'content_hash', 'VARCHAR')
+    _add_missing_column(connection, 'transactions', 'fingerprint', 'VARCHAR')
+
+    # Occurrences are counted across the whole group here, in id order, so
+    # rows already stored twice by overlapping uploads keep distinct prints
+    occurrences = Counter()
+    after_id = 0
+    while True:
+        rows = connection.execute(
+            text(
+                "SELECT t.id, f.group_id, COALESCE(t.iso_date, t.date) AS date, t.description, t.amount, t.owner "
+                "FROM transactions t JOIN files f ON f.id = t.file_id "
+                "WHERE t.id > :after_id ORDER BY t.id LIMIT 10000"
+            ),
+            {"after_id": after_id}
+        ).all()
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            key = crud.fingerprint_key(row.group_id, row.date, row.description, row.amount, row.owner)
+            updates.append({"id": row.id, "fingerprint": crud.row_fingerprint(key, occurrences[key])})
+            occurrences[key] += 1
+        connection.execute(text("UPDATE transactions SET fingerprint = :fingerprint WHERE id = :id"), updates)
+        after_id = rows[-1].id
+
+    _create_missing_indexes(connection, models.File.__table__)
+    _create_missing_indexes(connection, models.Transaction.__table__)
+
+
+@migration
+def m0005_group_cold_storage(connection):
+    # Groups archived or settled before this stay in the hot table until
+    # they are archived or settled again
+    _add_missing_column(connection, 'user_groups', 'cold_storage', 'BOOLEAN DEFAULT 0')
+
+
+@migration
+def m0006_suggested_actions(connection):
+    # Rows uploaded before this have no suggestion
+    _add_missing_column(connection, 'transactions', 'suggested_action', 'VARCHAR')
+
+
+@migration
+def m0007_group_members(connection):
+    models.GroupMember.__table__.create(bind=connection, checkfirst=True)
+    connection.execute(text(
+        "INSERT OR IGNORE INTO group_members (group_id, name, position) "
+        "SELECT id, person1, 0 FROM user_groups WHERE COALESCE(person1, '') != ''"
+    ))
+    connection.execute(text(
+        "INSERT OR IGNORE INTO group_members (group_id, name, position) "
+        "SELECT id, person2, 1 FROM user_groups WHERE COALESCE(person2, '') != ''"
+    ))
+
+
+@migration
+def m0008_group_month_totals(connection):
+    models.GroupMonthTotal.__table__.create(bind=connection, checkfirst=True)
+    with Session(bind=connection) as db:
+        crud.rebuild_month_totals(db)
+        # Archived and settled groups keep their rows in their archive file
+        fields = [archive.TRANSACTION_FIELDS.index(name) for name in ('date', 'owner', 'action', 'amount')]
+        cold = db.scalars(select(models.UserGroup.id).where(models.UserGroup.cold_storage == True)).all()
+        for group_id in cold:
+            changes = {}
+            for batch in archive.iter_group_batches(group_id):
+                crud.month_total_changes((
+                    (group_id, formats.sortable_date(date), owner, action, amount)
+                    for date, owner, action, amount in ([row[i] for i in fields] for row in batch)
+                ), 1, changes)
+            crud.apply_month_totals(db, changes)
+
+
+@migration
+def m0009_sync_revisions(connection):
+    # Everything written before revisions existed is revision 1. Archives
+    # written before this have no revision column; their rows are revision
+    # 1 too when thawed, through the column default.
+    for table in ('user_groups', 'files', 'transactions'):
+        _add_missing_column(connection, table, 'rev', "INTEGER DEFAULT '1'")
+    models.SyncRevision.__table__.create(bind=connection, checkfirst=True)
+    models.Tombstone.__table__.create(bind=connection, checkfirst=True)
+    connection.execute(text("INSERT OR IGNORE INTO sync_revision (id, value) VALUES (1, 1)"))
+    for table in (models.UserGroup, models.File, models.Transaction, models.Tombstone):
+        _create_missing_indexes(connection, table.__table__)
+
+
+@migration
+def m0010_transaction_search(connection):
+    # Archived and settled groups are indexed when they are restored
+    connection.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts USING fts5("
+        "description, content='transactions', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+    ))
+    with Session(bind=connection) as db:
+        crud.rebuild_search_index(db)
+
+
+@migration
+def m0011_transaction_autoincrement(connection):
+    # Without AUTOINCREMENT SQLite hands out max(id) + 1, so once a group
+    # holding the highest ids was archived its ids went to new rows and the
+    # archive could no longer be restored. SQLite cannot alter a primary key
+    # in place: the table is rebuilt with the same ids, which keeps the
+    # rowid-keyed search index valid.
+    table = models.Transaction.__table__
+    sql = connection.scalar(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'transactions'"))
+    if 'AUTOINCREMENT' not in sql.upper():
+        columns = ', '.join(column.name for column in table.columns)
+        metadata = MetaData()
+        models.File.__table__.to_metadata(metadata)  # target of the file_id foreign key
+        connection.execute(CreateTable(table.to_metadata(metadata, name='transactions_new')))
+        connection.execute(text(f"INSERT INTO transactions_new ({columns}) SELECT {columns} FROM transactions"))
+        connection.execute(text("DROP TABLE transactions"))
+        connection.execute(text("ALTER TABLE transactions_new RENAME TO transactions"))
+        _create_missing_indexes(connection, table)
+
+    # Ids of archived rows must not be handed out again either
+    with Session(bind=connection) as db:
+        cold = db.scalars(select(models.UserGroup.id).where(models.UserGroup.cold_storage == True)).all()
+    ids = [archive.max_id(group_id) for group_id in cold]
+    ids.append(connection.scalar(text("SELECT MAX(id) FROM transactions")))
+    ids.append(connection.scalar(text("SELECT seq FROM sqlite_sequence WHERE name = 'transactions'")))
+    connection.execute(text("DELETE FROM sqlite_sequence WHERE name = 'transactions'"))
+    connection.execute(
+        text("INSERT INTO sqlite_sequence (name, seq) VALUES ('transactions', :seq)"),
+        {"seq": max((i for i in ids if i is not None), default=0)}
+    )
+
+
+@migration
+def m0012_transaction_iso_dates(connection):
+    # Uploads store dates as ISO YYYY-MM-DD; rows stored before that keep the
+    # bank's format. Rewrite them wherever iso_date could be parsed, at a new
+    # revision so clients and cached responses pick the change up. Archived
+    # groups are thawed and frozen again around the rewrite.
+    with Session(bind=connection) as db:
+        cold = []
+        for group_id in db.scalars(select(models.UserGroup.id).where(models.UserGroup.cold_storage == True)).all():
+            try:
+                with db.begin_nested():
+                    archive.thaw_transactions(db, group_id)
+                cold.append(group_id)
+            except archive.RestoreConflict:
+                logger.warning(f"Archive of group {group_id} clashes with ids in use; its dates are left as they are")
+
+        rev = crud.next_revision(db)
+        stale = "iso_date IS NOT NULL AND date != iso_date"
+        connection.execute(text(
+            f"UPDATE files SET rev = :rev WHERE id IN (SELECT file_id FROM transactions WHERE {stale})"
+        ), {"rev": rev})
+        connection.execute(text(
+            "UPDATE user_groups SET rev = :rev WHERE id IN (SELECT group_id FROM files WHERE rev = :rev)"
+        ), {"rev": rev})
+        connection.execute(text(f"UPDATE transactions SET date = iso_date, rev = :rev WHERE {stale}"), {"rev": rev})
+
+        for group_id in cold:
+            archive.freeze_transactions(db, group_id)
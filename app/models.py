@@ -1,5 +1,5 @@
 import datetime
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Boolean, DateTime
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Boolean, DateTime, Index, column, func, table
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -13,23 +13,51 @@ class UserGroup(Base):
     is_hidden = Column(Boolean, default=False)
     is_archived = Column(Boolean, default=False)
     is_settled = Column(Boolean, default=False)
+    # Transactions live in the group's archive file instead (app/archive.py)
+    cold_storage = Column(Boolean, default=False)
     date_created = Column(DateTime, default=datetime.datetime.now(datetime.UTC))
+    # Revision of the last change to the group or its members, see SyncRevision
+    rev = Column(Integer, server_default='1', index=True)
 
     files = relationship('File', back_populates='group')
+    member_rows = relationship(
+        'GroupMember', order_by='GroupMember.position', lazy='selectin', cascade='all, delete-orphan'
+    )
+
+    @property
+    def members(self):
+        return [member.name for member in self.member_rows]
+
+
+class GroupMember(Base):
+    # Everyone sharing a group's expenses, in the order they joined;
+    # person1 and person2 are the first two
+    __tablename__ = 'group_members'
+
+    group_id = Column(Integer, ForeignKey('user_groups.id'), primary_key=True)
+    name = Column(String, primary_key=True)
+    position = Column(Integer)
 
 class File(Base):
     __tablename__ = 'files'
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
-    group_id = Column(Integer, ForeignKey('user_groups.id'))
+    group_id = Column(Integer, ForeignKey('user_groups.id'), index=True)
     owner = Column(String)
     balance_person1 = Column(Float, default=0.0)
     balance_person2 = Column(Float, default=0.0)
+    # SHA-256 of the uploaded statement, used to spot re-uploads
+    content_hash = Column(String, nullable=True)
+    rev = Column(Integer, server_default='1', index=True)
     
     group = relationship("UserGroup", back_populates="files")
     transactions = relationship("Transaction", back_populates="file")
 
+    __table_args__ = (
+        Index('ix_files_group_content_hash', 'group_id', 'content_hash'),
+    )
+
 
 class Transaction(Base):
     __tablename__ = 'transactions'
@@ -42,5 +70,111 @@ class Transaction(Base):
     action = Column(String)
     owner = Column(String)
     previous_action = Column(String, nullable=True)
+    # `date` normalized to YYYY-MM-DD so it sorts chronologically; NULL when
+    # the stored date could not be parsed
+    iso_date = Column(String, nullable=True)
+    # Identifies the row within its group across uploads, see
+    # crud.row_fingerprint; NULL for rows entered by hand
+    fingerprint = Column(String, nullable=True)
+    # Action predicted at upload from the owner's earlier actions, see
+    # merchants.suggest_actions; `action` stays 'Ignore' until confirmed
+    suggested_action = Column(String, nullable=True)
+    rev = Column(Integer, server_default='1')
 
     file = relationship('File', back_populates='transactions')
+
+    __table_args__ = (
+        # Lookup columns used when saving reviewed transactions. Not unique:
+        # a statement can legitimately contain identical charges.
+        Index('ix_transactions_match', 'file_id', 'date', 'description', 'amount'),
+        # Entries are implicitly ordered by rowid, which serves keyset paging
+        Index('ix_transactions_file_id', 'file_id'),
+        Index('ix_transactions_fingerprint', 'fingerprint'),
+        # (rev, rowid) order serves the sync cursor
+        Index('ix_transactions_rev', 'rev'),
+        # Ids are never handed out twice, even after the rows holding the
+        # highest ones move to an archive; a restore puts them back as they were
+        {'sqlite_autoincrement': True},
+    )
+
+
+# Serves the latest-action rebuild, which keys descriptions the same way
+Index(
+    'ix_transactions_owner_description_date',
+    Transaction.owner,
+    func.lower(func.trim(Transaction.description)),
+    Transaction.iso_date
+)
+
+
+class LastAction(Base):
+    # Latest transaction per (owner, normalized description), maintained by
+    # crud whenever transactions are inserted, updated or deleted
+    __tablename__ = 'last_actions'
+
+    owner = Column(String, primary_key=True)
+    description = Column(String, primary_key=True)
+    action = Column(String)
+    date = Column(String)
+    transaction_id = Column(Integer, index=True)
+
+
+class GroupBalance(Base):
+    # Sum of file balances per group, kept in step with file writes by crud
+    __tablename__ = 'group_balances'
+
+    group_id = Column(Integer, ForeignKey('user_groups.id'), primary_key=True)
+    balance_person1 = Column(Float, default=0.0)
+    balance_person2 = Column(Float, default=0.0)
+
+
+class GroupMonthTotal(Base):
+    # Sum and count of transaction amounts per group, month, owner and
+    # action, kept in step with transaction writes by crud so the group
+    # summary is read from buckets rather than transactions. Archiving a
+    # group leaves its buckets in place. Undated rows go in month ''.
+    __tablename__ = 'group_month_totals'
+
+    group_id = Column(Integer, ForeignKey('user_groups.id'), primary_key=True)
+    month = Column(String, primary_key=True)
+    owner = Column(String, primary_key=True)
+    action = Column(String, primary_key=True)
+    total = Column(Float, default=0.0)
+    count = Column(Integer, default=0)
+
+
+class SyncRevision(Base):
+    # Single-row counter bumped once per write transaction by
+    # crud.next_revision. Groups, files and transactions carry the revision
+    # of their last change, so GET /sync can return what changed after a
+    # revision the client has seen. Rows written before revisions existed
+    # have revision 1.
+    __tablename__ = 'sync_revision'
+
+    id = Column(Integer, primary_key=True)
+    value = Column(Integer, nullable=False)
+
+
+class Tombstone(Base):
+    # Deleted files, for GET /sync; a file's transactions go with it
+    __tablename__ = 'tombstones'
+
+    id = Column(Integer, primary_key=True)
+    rev = Column(Integer, index=True)
+    kind = Column(String)
+    object_id = Column(Integer)
+    group_id = Column(Integer)
+
+
+# FTS5 index over Transaction.description, with the transactions table as its
+# external content and the transaction id as its rowid. A virtual table is
+# outside the declarative metadata (create_all cannot build it), so it is
+# created by a migration and kept in step with hot transactions by crud.
+# Writing the table's own column runs an FTS5 command such as 'delete'.
+transactions_fts = table(
+    'transactions_fts',
+    column('transactions_fts'),
+    column('rowid', Integer),
+    column('description', String),
+    column('rank', Float),
+)
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, ConfigDict
+from typing import Dict, List, Optional
 from datetime import datetime
 
 class TransactionBase(BaseModel):
@@ -21,9 +21,9 @@ class TransactionCreate(TransactionBase):
 class Transaction(TransactionBase):
     id: int
     file_id: int
+    suggested_action: Optional[str] = None
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class FileBase(BaseModel):
     name: str
@@ -33,20 +33,18 @@ class FileBase(BaseModel):
     balance_person2: float = 0.0
 
 class FileCreate(FileBase):
-    pass
+    content_hash: Optional[str] = None
 
 class File(FileBase):
     id: int
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class FileBalanceUpdate(BaseModel):
     balance_person1: float
     balance_person2: float
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class UserGroupBase(BaseModel):
     name: str
@@ -57,21 +55,117 @@ class UserGroupBase(BaseModel):
     date_created: Optional[datetime] = None
     is_settled: Optional[bool] = False
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class UserGroupCreate(UserGroupBase):
-    pass
+    # Members besides person1 and person2
+    members: List[str] = []
 
 class UserGroup(UserGroupBase):
     id: int
+    members: List[str] = []
     files: List[File] = []
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+class GroupMemberCreate(BaseModel):
+    name: str
+
+class Transfer(BaseModel):
+    debtor: str
+    creditor: str
+    amount: float
+
+class Settlement(BaseModel):
+    # Net position of every member (positive = owed money) and the
+    # transfers that bring them all to zero
+    balances: Dict[str, float]
+    transfers: List[Transfer]
+
+class MonthTotal(BaseModel):
+    month: str
+    total: float
+    count: int
+
+class ActionTotal(BaseModel):
+    action: str
+    total: float
+    count: int
+
+class OwnerTotal(BaseModel):
+    owner: str
+    total: float
+    count: int
+
+class GroupSummary(BaseModel):
+    # Sums of statement amounts (charges negative) and row counts; months
+    # are YYYY-MM, with '' for rows whose date could not be read
+    group_id: int
+    month_from: Optional[str] = None
+    month_to: Optional[str] = None
+    total: float
+    count: int
+    by_month: List[MonthTotal]
+    by_action: List[ActionTotal]
+    by_owner: List[OwnerTotal]
 
 class GroupBalance(UserGroupBase):
     id: int
     balance_person1: float
     balance_person2: float
-    
\ No newline at end of file
+    
+class IngestJob(BaseModel):
+    id: str
+    group_id: int
+    filename: str
+    owner: str
+    status: str
+    rows_parsed: int = 0
+    rows_inserted: int = 0
+    rows_duplicate: int = 0
+    duplicate: bool = False
+    # Seconds per ingest stage: read, translate, parse, insert
+    timings: Dict[str, float] = {}
+    file_id: Optional[int] = None
+    error: Optional[str] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+class SyncGroup(UserGroupBase):
+    id: int
+    members: List[str] = []
+    rev: int
+
+class SyncFile(File):
+    rev: int
+
+class SyncTransaction(Transaction):
+    rev: int
+
+class Tombstone(BaseModel):
+    kind: str
+    id: int
+    group_id: Optional[int] = None
+    rev: int
+
+class SyncChanges(BaseModel):
+    # Rows changed after the requested revision. Pass `rev` (and `after_id`
+    # when set) back as the next cursor; `more` means the transactions were
+    # cut off at the page size and the next page should follow right away.
+    rev: int
+    after_id: Optional[int] = None
+    more: bool = False
+    groups: List[SyncGroup]
+    files: List[SyncFile]
+    transactions: List[SyncTransaction]
+    deleted: List[Tombstone]
+
+class SearchHit(Transaction):
+    group_id: Optional[int] = None
+    # Higher is a better match
+    score: float
+
+class SearchResults(BaseModel):
+    results: List[SearchHit]
+    # Pass back as `cursor` for the next page; None on the last page
+    next_cursor: Optional[str] = None
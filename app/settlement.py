@@ -0,0 +1,103 @@
+import datetime
+import heapq
+from collections import defaultdict
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from . import archive, balances, crud, models
+
+# Settling a group pays off every member's net balance with as few
+# transfers as the greedy method below finds: at most one fewer than the
+# number of members with a balance, and usually far fewer. Amounts are
+# handled in whole cents so the transfers add up exactly.
+
+
+def member_totals(group: models.UserGroup, db: Session):
+    # (payer, action, total amount) for the group, from the archive when
+    # its transactions are in cold storage
+    if not group.cold_storage:
+        return crud.get_member_totals(db, group.id)
+    owner, action, amount = (archive.TRANSACTION_FIELDS.index(name) for name in ('owner', 'action', 'amount'))
+    totals = defaultdict(float)
+    for batch in archive.iter_group_batches(group.id):
+        for row in batch:
+            totals[(row[owner], row[action])] += row[amount] or 0
+    return [(payer, payer_action, total) for (payer, payer_action), total in totals.items()]
+
+
+def net_cents(group: models.UserGroup, db: Session):
+    # Member -> what they are owed (positive) or owe (negative), in cents
+    members = group.members
+    rows = member_totals(group, db)
+    owners, actions, amounts = zip(*rows) if rows else ((), (), ())
+    exact = np.round(balances.net_balances(owners, actions, amounts, members) * 100, 6)
+    # Nets add up to zero but their whole cents may not after an uneven
+    # split: truncate, then hand the cents left over to the members who lost
+    # the most. Fractions of a cent left after settling truncate to zero, so
+    # a settled group stays square.
+    cents = np.trunc(exact)
+    leftover = int(np.round(cents.sum()))
+    if leftover:
+        error = (cents - exact) * np.sign(leftover)
+        cents[np.argsort(-error, kind='stable')[:abs(leftover)]] -= np.sign(leftover)
+    return {member: int(value) for member, value in zip(members, cents)}
+
+
+def simplify_debts(nets):
+    # Greedy debt simplification: debts that exactly cancel a credit are
+    # paired first, then the largest debtor repeatedly pays the largest
+    # creditor until one of them is square. Returns (debtor, creditor,
+    # cents) transfers.
+    transfers = []
+    creditors = {}
+    for member, cents in nets.items():
+        if cents > 0:
+            creditors.setdefault(cents, []).append(member)
+    debtors = []
+    for member, cents in nets.items():
+        if cents < 0:
+            match = creditors.get(-cents)
+            if match:
+                transfers.append((member, match.pop(), -cents))
+            else:
+                debtors.append((cents, member))
+    credits = [(-cents, member) for cents, members in creditors.items() for member in members]
+
+    heapq.heapify(debtors)
+    heapq.heapify(credits)
+    while debtors and credits:
+        debt, debtor = heapq.heappop(debtors)
+        credit, creditor = heapq.heappop(credits)
+        amount = min(-debt, -credit)
+        transfers.append((debtor, creditor, amount))
+        if debt + amount:
+            heapq.heappush(debtors, (debt + amount, debtor))
+        if credit + amount:
+            heapq.heappush(credits, (credit + amount, creditor))
+    return transfers
+
+
+def plan(group: models.UserGroup, db: Session):
+    nets = net_cents(group, db)
+    return {
+        'balances': {member: cents / 100 for member, cents in nets.items()},
+        'transfers': [
+            {'debtor': debtor, 'creditor': creditor, 'amount': cents / 100}
+            for debtor, creditor, cents in simplify_debts(nets)
+        ]
+    }
+
+
+def settle_group(db: Session, group_id: int):
+    # Records the transfers as settlement transactions, then marks the
+    # group settled (moving it to cold storage) in the same transaction
+    db_group = crud.get_group(db, group_id=group_id)
+    if db_group is None:
+        return None, []
+    transfers = [
+        (debtor, creditor, cents / 100)
+        for debtor, creditor, cents in simplify_debts(net_cents(db_group, db))
+    ]
+    crud.create_settlement_files(db, db_group, transfers, datetime.date.today().isoformat())
+    return archive.update_group(db, group_id, is_settled=True), transfers
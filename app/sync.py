@@ -0,0 +1,126 @@
+import asyncio
+import os
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import Session
+
+from . import archive, crud, models
+from .database import SessionLocal
+
+# Delta sync: every write transaction takes the next revision from
+# crud.next_revision and stamps the groups, files and transactions it
+# changes; deleted files leave a tombstone. GET /sync?since=<rev> returns
+# what changed after a revision, and /sync/events pushes the current
+# revision whenever it moves, so clients refetch only when something changed.
+SYNC_PAGE_ROWS = int(os.getenv("SYNC_PAGE_ROWS", "5000"))
+SYNC_POLL_SECONDS = float(os.getenv("SYNC_POLL_SECONDS", "0.5"))
+SYNC_KEEPALIVE_SECONDS = 15
+
+CHANGE_FIELDS = archive.TRANSACTION_FIELDS + ('rev',)
+_ID = CHANGE_FIELDS.index('id')
+
+
+def changes(db: Session, since: int, after_id: int = None, limit: int = SYNC_PAGE_ROWS):
+    # The revision is read first: whatever committed before it is picked up
+    # below, and rows that commit meanwhile are sent again next time.
+    # Transactions are paged on (rev, id); groups, files and tombstones are
+    # few and always sent in full.
+    rev = crud.get_revision(db)
+    UserGroup, File, Transaction, Tombstone = models.UserGroup, models.File, models.Transaction, models.Tombstone
+
+    groups = db.scalars(select(UserGroup).where(UserGroup.rev > since).order_by(UserGroup.rev, UserGroup.id)).all()
+    files = db.scalars(select(File).where(File.rev > since).order_by(File.rev, File.id)).all()
+    deleted = db.execute(
+        select(Tombstone.kind, Tombstone.object_id, Tombstone.group_id, Tombstone.rev)
+        .where(Tombstone.rev > since)
+        .order_by(Tombstone.rev, Tombstone.id)
+    ).all()
+
+    after = Transaction.rev > since
+    if after_id is not None:
+        after = tuple_(Transaction.rev, Transaction.id) > tuple_(since, after_id)
+    rows = db.execute(
+        select(*(getattr(Transaction, name) for name in CHANGE_FIELDS))
+        .where(after)
+        .order_by(Transaction.rev, Transaction.id)
+        .limit(limit + 1)
+    ).all()
+    # A group archived or settled since then took its changed rows along;
+    # rows cannot change while a group is cold, so no other archive can hold any
+    for group in groups:
+        if group.cold_storage:
+            for batch in archive.iter_changed_rows(group.id, since, after_id):
+                rows.extend(batch)
+    rows.sort(key=lambda row: (row[-1], row[_ID]))
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if more:
+        rev, after_id = rows[-1][-1], rows[-1][_ID]
+    return {
+        'rev': rev,
+        'after_id': after_id if more else None,
+        'more': more,
+        'groups': groups,
+        'files': files,
+        'transactions': [dict(zip(CHANGE_FIELDS, row)) for row in rows],
+        'deleted': [
+            {'kind': kind, 'id': object_id, 'group_id': group_id, 'rev': deleted_rev}
+            for kind, object_id, group_id, deleted_rev in deleted
+        ],
+    }
+
+
+def _read_revision():
+    with SessionLocal() as db:
+        return crud.get_revision(db)
+
+
+class RevisionFeed:
+    # One poller per event loop reads the revision every SYNC_POLL_SECONDS
+    # while anyone is listening and wakes the listeners when it moves. A
+    # single-row read per interval costs the same for one listener or a
+    # thousand, and sees writes from other processes too.
+    def __init__(self):
+        self.rev = None
+        self._loop = None
+        self._changed = None
+        self._listeners = 0
+        self._poller = None
+
+    async def _poll(self):
+        while self._listeners:
+            rev = await asyncio.to_thread(_read_revision)
+            if rev != self.rev:
+                self.rev = rev
+                async with self._changed:
+                    self._changed.notify_all()
+            await asyncio.sleep(SYNC_POLL_SECONDS)
+        self._poller = None
+
+    async def watch(self, since: int):
+        # Yields each revision newer than `since` as it appears, or None
+        # after SYNC_KEEPALIVE_SECONDS without one
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._changed, self._poller, self.rev = loop, asyncio.Condition(), None, None
+        self._listeners += 1
+        if self._poller is None:
+            self._poller = asyncio.create_task(self._poll())
+        try:
+            while True:
+                async with self._changed:
+                    try:
+                        await asyncio.wait_for(
+                            self._changed.wait_for(lambda: self.rev is not None and self.rev > since),
+                            SYNC_KEEPALIVE_SECONDS
+                        )
+                        since = rev = self.rev
+                    except asyncio.TimeoutError:
+                        rev = None
+                yield rev
+        finally:
+            self._listeners -= 1
+
+
+feed = RevisionFeed()
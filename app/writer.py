@@ -0,0 +1,104 @@
+import asyncio
+import contextvars
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from .database import write_engine
+
+logger = logging.getLogger(__name__)
+
+# Small writes from request handlers are funnelled through one writer thread.
+# Jobs that arrive together share a single SQLite transaction (one fsync),
+# each inside its own SAVEPOINT so a failing job does not undo the others.
+WRITE_BATCH_MAX = int(os.getenv("WRITE_BATCH_MAX", "64"))
+# BEGIN IMMEDIATE waits up to busy_timeout for the write lock; when some
+# other connection holds it longer the group tries again this many times
+# before its jobs fail
+WRITE_LOCK_RETRIES = int(os.getenv("WRITE_LOCK_RETRIES", "5"))
+
+
+class WriteQueue:
+    def __init__(self, engine, max_batch: int = WRITE_BATCH_MAX):
+        self._engine = engine
+        self._max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        # fn is called as fn(session, *args, **kwargs) on the writer thread,
+        # in a copy of the caller's context so per-request metrics see it
+        self._ensure_started()
+        future = Future()
+        self._queue.put((contextvars.copy_context(), fn, args, kwargs, future))
+        return future
+
+    def run(self, fn, *args, **kwargs):
+        return self.submit(fn, *args, **kwargs).result()
+
+    async def run_async(self, fn, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="db-writer", daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self._max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit_group(batch)
+
+    def _commit_group(self, batch):
+        outcomes = []
+        try:
+            with self._engine.connect() as connection:
+                transaction = self._begin(connection)
+                for context, fn, args, kwargs, future in batch:
+                    savepoint = connection.begin_nested()
+                    session = Session(bind=connection, autoflush=False, join_transaction_mode="create_savepoint")
+                    try:
+                        result = context.run(fn, session, *args, **kwargs)
+                        session.close()
+                        savepoint.commit()
+                        outcomes.append((future, result, None))
+                    except Exception as e:
+                        session.close()
+                        savepoint.rollback()
+                        outcomes.append((future, None, e))
+                transaction.commit()
+        except Exception as e:
+            logger.error(f"Error committing write batch: {str(e)}")
+            for *_, future in batch:
+                future.set_exception(e)
+            return
+
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def _begin(self, connection):
+        for attempt in range(WRITE_LOCK_RETRIES + 1):
+            try:
+                return connection.begin()
+            except OperationalError as e:
+                if attempt == WRITE_LOCK_RETRIES or "database is locked" not in str(e.orig):
+                    raise
+                logger.warning(f"Write lock still held, retrying ({attempt + 1}/{WRITE_LOCK_RETRIES})")
+
+
+write_queue = WriteQueue(write_engine)
@@ -0,0 +1,96 @@
+# Latency of cheap reads while heavy writes run on the same event loop.
+#
+#   python -m benchmarks.concurrency [rows] [seconds]
+#
+# The app runs in-process in a temporary directory. Writers keep saving a
+# large reviewed file through POST /groups/{id}/transactions while a reader
+# polls GET / and GET /groups/{id}; p50/p99 of the reads are reported.
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+os.chdir(tempfile.mkdtemp())
+
+import httpx  # noqa: E402
+
+from app.main import app  # noqa: E402
+
+logging.disable(logging.INFO)
+
+
+def make_payload(file_id: int, rows: int, action: str):
+    return [
+        {
+            'date': f'2024-01-{i % 28 + 1:02d}',
+            'description': f'MERCHANT {i}',
+            'amount': -float(i % 100),
+            'action': action,
+            'owner': 'a',
+            'previous_action': '',
+            'file_id': file_id
+        }
+        for i in range(rows)
+    ]
+
+
+async def writer(client, group_id, file_id, rows, stop):
+    actions = ['Split', 'Ignore']
+    count = 0
+    while not stop.is_set():
+        payload = make_payload(file_id, rows, actions[count % 2])
+        response = await client.post(f'/groups/{group_id}/transactions', json=payload)
+        response.raise_for_status()
+        count += 1
+    return count
+
+
+async def reader(client, group_id, stop):
+    latencies = []
+    while not stop.is_set():
+        for path in ('/', f'/groups/{group_id}'):
+            start = time.perf_counter()
+            response = await client.get(path)
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+        await asyncio.sleep(0.005)
+    return latencies
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def main(rows: int, seconds: float):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        group = (await client.post('/groups/', json={'name': 'bench', 'person1': 'a', 'person2': 'b'})).json()
+        csv = 'Date,Description,Amount\n01/01/2024,SEED,1\n'
+        await client.post(f"/groups/{group['id']}/upload", data={'owner': 'a'}, files={'file': ('seed.csv', csv)})
+        await asyncio.sleep(0.5)
+        file_id = (await client.get(f"/groups/{group['id']}/files")).json()[0]['id']
+
+        stop = asyncio.Event()
+        tasks = [
+            asyncio.create_task(writer(client, group['id'], file_id, rows, stop)),
+            asyncio.create_task(writer(client, group['id'], file_id, rows, stop)),
+            asyncio.create_task(reader(client, group['id'], stop)),
+        ]
+        await asyncio.sleep(seconds)
+        stop.set()
+        *writes, latencies = await asyncio.gather(*tasks)
+
+    print(f"writes: {sum(writes)} batches of {rows} rows")
+    print(f"reads:  {len(latencies)}")
+    print(f"p50:    {statistics.median(latencies) * 1000:.1f} ms")
+    print(f"p99:    {percentile(latencies, 0.99) * 1000:.1f} ms")
+    print(f"max:    {max(latencies) * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    asyncio.run(main(int(args[0]) if args else 5000, float(args[1]) if len(args) > 1 else 10.0))
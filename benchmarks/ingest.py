@@ -0,0 +1,81 @@
+# Compare the old per-row upload path with the bulk ingest path.
+#
+#   python -m benchmarks.ingest [rows ...]
+#
+# Each run uses a fresh SQLite file so both paths pay for real commits.
+import io
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, migrations, schemas
+from app.ingest import frame_rows, translate_headers
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+
+
+def make_csv(rows: int) -> str:
+    lines = ['Transaction Date,Post Date,Description,Category,Type,Amount,Memo']
+    for i in range(rows):
+        day = i % 28 + 1
+        lines.append(f'01/{day:02d}/2024,01/{day:02d}/2024,MERCHANT {i % 500},Shopping,Sale,-{i % 100}.{i % 100:02d},')
+    return '\n'.join(lines) + '\n'
+
+
+def fresh_session(path: str):
+    engine = create_engine(f'sqlite:///{path}', connect_args={"check_same_thread": False})
+    migrations.upgrade(engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    group = crud.create_group(db, schemas.UserGroupCreate(name='bench', person1='a', person2='b'))
+    return engine, db, group
+
+
+def per_row(db, group, df):
+    db_file = crud.create_file(db, schemas.FileCreate(name='bench.csv', group_id=group.id, owner='a'))
+    for index, row in df.iterrows():
+        transaction = schemas.TransactionCreate(
+            date=row['Transaction_Date'],
+            description=row['Description'],
+            amount=row['Amount'],
+            action='Ignore',
+            file_id=db_file.id,
+            owner='a',
+            previous_action=''
+        )
+        crud.upsert_transactions(db=db, transactions=[transaction])
+
+
+def bulk(db, group, df):
+    file_data = schemas.FileCreate(name='bench.csv', group_id=group.id, owner='a')
+    crud.create_file_with_transactions(db=db, file=file_data, rows=frame_rows(df))
+
+
+def run(path_fn, df) -> float:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine, db, group = fresh_session(os.path.join(tmp, 'bench.db'))
+        try:
+            start = time.perf_counter()
+            path_fn(db, group, df)
+            elapsed = time.perf_counter() - start
+        finally:
+            db.close()
+            engine.dispose()
+    return len(df) / elapsed
+
+
+def main(sizes):
+    print(f"{'rows':>8} {'per-row rows/s':>16} {'bulk rows/s':>14} {'speedup':>8}")
+    for rows in sizes:
+        df = translate_headers(pd.read_csv(io.StringIO(make_csv(rows))))
+        before = run(per_row, df)
+        after = run(bulk, df)
+        print(f"{rows:>8} {before:>16.0f} {after:>14.0f} {after / before:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,100 @@
+# Full-text search against a LIKE scan over transaction descriptions.
+#
+#   python -m benchmarks.search [rows]
+#
+# Synthetic statements (1M rows by default, spread over groups of two files)
+# are ingested through crud, which keeps the FTS5 index up to date. Each
+# query is then answered both ways: the first page of 50 (FTS ranked and
+# newest first, LIKE in id order, which stops at the 50th match) and every
+# match. The matches are checked to agree.
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'search.db')}"
+
+import logging
+
+logging.disable(logging.CRITICAL)
+
+from sqlalchemy import func, select
+
+from app import crud, models
+from app.database import SessionLocal
+from app.main import app  # noqa: F401  (creates the schema)
+from benchmarks import synthetic
+
+ROWS_PER_FILE = 50_000
+PAGE = 50
+REPEAT = 5
+# (text, LIKE pattern, group filter); a single trip code is added at run time
+QUERIES = [
+    ('costco', '%costco%', False),
+    ('delta air', '%delta air%', False),
+    ('walgreens', '%walgreens%', True),
+    ('netflix', '%netflix%', True),
+]
+
+
+def like_query(pattern: str, group_id: int = None):
+    Transaction, File = models.Transaction, models.File
+    # The same columns search_transactions returns, in id order
+    query = (
+        select(*crud._transaction_columns(), File.group_id)
+        .join(File, File.id == Transaction.file_id)
+        .where(Transaction.description.ilike(pattern))
+        .order_by(Transaction.id)
+    )
+    return query if group_id is None else query.where(File.group_id == group_id)
+
+
+def timed(fn):
+    times = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return result, statistics.median(times) * 1000
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    files = max(1, rows // ROWS_PER_FILE)
+    with SessionLocal() as db:
+        start = time.perf_counter()
+        group_ids = synthetic.seed_database(
+            db, groups=-(-files // 2), files_per_group=min(2, files), rows_per_file=rows // files, seed='search'
+        )
+        total = db.scalar(select(func.count()).select_from(models.Transaction))
+        print(f"ingested {total} rows in {time.perf_counter() - start:.1f} s (search index included)")
+
+        # A reference code appears on one row, or a few repeated charges
+        trip = db.scalar(
+            select(models.Transaction.description).where(models.Transaction.description.like('UBER%')).offset(1000).limit(1)
+        )
+        code = trip.split()[-1]
+
+        failures = 0
+        for text, pattern, filtered in QUERIES + [(code, f'%{code}%', False)]:
+            group_id = group_ids[0] if filtered else None
+            _, fts_page_ms = timed(lambda: crud.search_transactions(db, text, group_id=group_id, limit=PAGE))
+            _, recent_page_ms = timed(lambda: crud.search_transactions(
+                db, text, group_id=group_id, order='recent', limit=PAGE
+            ))
+            _, like_page_ms = timed(lambda: db.execute(like_query(pattern, group_id).limit(PAGE)).all())
+            fts_all, fts_all_ms = timed(lambda: crud.search_transactions(db, text, group_id=group_id, limit=None))
+            like_all, like_all_ms = timed(lambda: db.execute(like_query(pattern, group_id)).all())
+            ok = sorted(row.id for row in fts_all) == [row.id for row in like_all]
+            failures += not ok
+            label = f"{text!r}" + (" in one group" if filtered else "")
+            print(f"{'ok  ' if ok else 'FAIL'} {label:<26} {len(like_all):>8} matches")
+            print(f"       first {PAGE}  fts ranked {fts_page_ms:8.1f} ms   fts recent {recent_page_ms:8.1f} ms   "
+                  f"like {like_page_ms:8.1f} ms")
+            print(f"       all       fts        {fts_all_ms:8.1f} ms   {'':24} like {like_all_ms:8.1f} ms")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
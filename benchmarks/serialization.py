@@ -0,0 +1,68 @@
+# Time the fast serialization path of the list endpoints.
+#
+#   python -m benchmarks.serialization [rows ...]
+#
+# Serializes a file's transactions both through response_model validation of
+# the ORM objects and through Core rows straight to orjson, and checks the
+# bodies agree. tests/test_serialization.py holds the golden check of the
+# endpoints themselves.
+import os
+import sys
+import tempfile
+import time
+from typing import List
+
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'serialization.db')}"
+
+import logging
+
+logging.disable(logging.CRITICAL)
+
+from app import cache, crud, schemas
+from app.database import SessionLocal
+from app.main import app  # noqa: F401  (creates the schema)
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+
+
+def make_rows(count: int):
+    # Whole and fractional amounts, since the Integer amount column stores
+    # whole ones as ints; non-ASCII text to cover escaping
+    return [
+        (f'2024-01-{i % 28 + 1:02d}', f'MERCHANT {i % 500} café "{i}"', -float(i % 100) - (i % 3) * 0.25)
+        for i in range(count)
+    ]
+
+
+def bench(db, group_id: int, count: int):
+    file_id = crud.create_file_with_transactions(
+        db, schemas.FileCreate(name=f'{count}.csv', group_id=group_id, owner='a'), make_rows(count)
+    ).id
+    db.expunge_all()
+
+    start = time.perf_counter()
+    body = cache.encode(List[schemas.Transaction], crud.get_transactions_by_file_id(db, file_id=file_id))
+    orm_seconds = time.perf_counter() - start
+    db.expunge_all()
+
+    start = time.perf_counter()
+    result = crud.get_transaction_rows(db, file_id=file_id)
+    fast_body = cache.encode_rows(result.keys(), result)
+    fast_seconds = time.perf_counter() - start
+
+    assert body == fast_body
+    print(f'{count:>8} rows  orm+pydantic {orm_seconds * 1000:8.1f} ms  core+orjson {fast_seconds * 1000:8.1f} ms'
+          f'  {orm_seconds / fast_seconds:5.1f}x')
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    with SessionLocal() as db:
+        group = crud.create_group(db, schemas.UserGroupCreate(name='serialization', person1='a', person2='b'))
+        group_id = group.id
+        for count in sizes:
+            bench(db, group_id, count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# Check and time debt simplification for large groups.
+#
+#   python -m benchmarks.settlement [members ...]
+#
+# Random member nets (in cents, adding up to zero) are settled with
+# settlement.simplify_debts. Each plan is checked to bring every member to
+# exactly zero with at most one transfer fewer than the members holding a
+# balance. Groups with nothing to settle (no transactions, or only ignored
+# ones) are checked to come out square with no transfers. Exits non-zero if
+# any plan fails the check.
+import random
+import sys
+import time
+from collections import Counter
+
+from app import balances, settlement
+
+DEFAULT_SIZES = [10, 50, 1_000, 10_000, 100_000]
+MEMBERS = ['a', 'b', 'c']
+# (label, owners, actions, amounts)
+SQUARE_GROUPS = [
+    ('no transactions', [], [], []),
+    ('all ignored', ['a', 'b', 'c'], ['Ignore'] * 3, [-12.5, -40.0, 3.0]),
+]
+
+
+def random_nets(members: int, seed=0):
+    rng = random.Random(seed)
+    # Round amounts repeat, so some debts cancel a credit exactly
+    cents = [rng.choice([rng.randrange(-50_000, 50_000), rng.randrange(-20, 20) * 500]) for _ in range(members - 1)]
+    cents.append(-sum(cents))
+    return {f'member {i}': value for i, value in enumerate(cents)}
+
+
+def check(nets, transfers):
+    remaining = Counter(nets)
+    for debtor, creditor, cents in transfers:
+        if cents <= 0:
+            return False
+        remaining[debtor] += cents
+        remaining[creditor] -= cents
+    holding = sum(1 for cents in nets.values() if cents)
+    return not any(remaining.values()) and len(transfers) <= max(holding - 1, 0)
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or DEFAULT_SIZES
+    failures = 0
+    for label, owners, actions, amounts in SQUARE_GROUPS:
+        nets = {
+            member: int(round(value * 100))
+            for member, value in zip(MEMBERS, balances.net_balances(owners, actions, amounts, MEMBERS))
+        }
+        transfers = settlement.simplify_debts(nets)
+        ok = not any(nets.values()) and not transfers
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {label}")
+    for members in sizes:
+        nets = random_nets(members, seed=members)
+        start = time.perf_counter()
+        transfers = settlement.simplify_debts(nets)
+        elapsed = time.perf_counter() - start
+        ok = check(nets, transfers)
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {members:>8} members  {len(transfers):>8} transfers  {elapsed * 1000:9.1f} ms")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
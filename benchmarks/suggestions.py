@@ -0,0 +1,94 @@
+# Hit rate and speed of suggested actions against exact description matches.
+#
+#   python -m benchmarks.suggestions [history_rows] [new_rows]
+#
+# An owner reviews a synthetic history statement, giving every merchant
+# category a fixed action. A later statement (new store numbers and
+# reference codes) is then looked up both ways: by exact normalized
+# description, as last_actions does, and through the merchant index.
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'suggestions.db')}"
+
+import logging
+
+logging.disable(logging.CRITICAL)
+
+from app import crud, merchants, schemas
+from app.database import SessionLocal
+from app.main import app  # noqa: F401  (creates the schema)
+from benchmarks import synthetic
+
+CATEGORY_ACTIONS = {
+    'Groceries': 'Split',
+    'Food & Drink': 'alex',
+    'Gas': 'Split',
+    'Shopping': 'sam',
+    'Travel': 'Split',
+    'Entertainment': 'alex',
+    'Bills & Utilities': 'Split',
+    'Health & Wellness': 'sam',
+    'Refund': 'Split',
+}
+
+
+def review_history(db, group_id: int, rows: int):
+    statement = list(synthetic.transactions(rows, seed='history'))
+    db_file = crud.create_file_with_transactions(
+        db, schemas.FileCreate(name='history.csv', group_id=group_id, owner='alex'),
+        ((day.isoformat(), description, amount) for day, description, category, amount in statement)
+    )
+    expected = [CATEGORY_ACTIONS[category] for *_, category, amount in statement]
+    saved = crud.get_transactions_by_file_id(db, file_id=db_file.id)
+    crud.upsert_transactions(db, [
+        schemas.TransactionCreate(
+            date=t.date, description=t.description, amount=t.amount, action=action,
+            owner=t.owner, previous_action='', file_id=t.file_id
+        )
+        for t, action in zip(saved, expected)
+    ])
+    return {crud.normalize_description(t.description): action for t, action in zip(saved, expected)}
+
+
+def score(predictions, expected):
+    hits = [(p, e) for p, e in zip(predictions, expected) if p is not None]
+    return len(hits) / len(expected), sum(p == e for p, e in hits) / max(len(hits), 1)
+
+
+def main():
+    history_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+    new_rows = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+
+    with SessionLocal() as db:
+        group = crud.create_group(db, schemas.UserGroupCreate(name='suggestions', person1='alex', person2='sam'))
+        exact = review_history(db, group.id, history_rows)
+
+        merchants.forget('alex')
+        start = time.perf_counter()
+        merchants.get_index(db, 'alex')
+        build = time.perf_counter() - start
+
+        statement = list(synthetic.transactions(new_rows, seed='new', start=datetime.date(2024, 7, 1)))
+        descriptions = [description for _, description, _, _ in statement]
+        expected = [CATEGORY_ACTIONS[category] for *_, category, _ in statement]
+
+        start = time.perf_counter()
+        suggested = merchants.suggest_actions(db, 'alex', descriptions)
+        elapsed = time.perf_counter() - start
+
+    exact_coverage, exact_accuracy = score(
+        [exact.get(crud.normalize_description(description)) for description in descriptions], expected
+    )
+    coverage, accuracy = score(suggested, expected)
+    print(f"history {history_rows} rows, index built in {build * 1000:.1f} ms")
+    print(f"new statement {new_rows} rows, suggested in {elapsed * 1000:.1f} ms ({new_rows / elapsed:,.0f} rows/s)")
+    print(f"   exact description  hit rate {exact_coverage:6.1%}  correct {exact_accuracy:6.1%}")
+    print(f"   merchant index     hit rate {coverage:6.1%}  correct {accuracy:6.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+# Scripted load scenarios against the app, with results written as JSON.
+#
+#   python -m benchmarks.suite [--scale small|medium|large] [--output results.json]
+#   python -m benchmarks.suite --compare before.json after.json
+#
+# The app runs in-process on a fresh database in a temporary directory and is
+# driven over ASGI, so every request goes through routing, validation, the
+# read cache and the writer queue like a real one. Data comes from
+# benchmarks.synthetic with fixed seeds, so runs at the same scale are
+# comparable. --compare prints the change of every metric between two runs.
+# The batch upload scenario parses on a spawned process pool, whose workers
+# import this module again; the guard at the bottom keeps them idle.
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# The app reads its configuration on import, so point it at a throwaway
+# database and upload directory first
+INVOKED_FROM = os.getcwd()
+os.chdir(tempfile.mkdtemp())
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.abspath('bench.db')}"
+
+import httpx  # noqa: E402
+
+from app import cache, ingest  # noqa: E402
+from app.database import SessionLocal  # noqa: E402
+from app.main import app  # noqa: E402
+from benchmarks import synthetic  # noqa: E402
+
+logging.disable(logging.INFO)
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCALES = {
+    'small': dict(upload_rows=2_000, save_batches=[100, 1_000], query_sizes=[100, 1_000], groups=200, repeat=5),
+    'medium': dict(upload_rows=20_000, save_batches=[100, 1_000, 5_000], query_sizes=[100, 1_000, 10_000],
+                   groups=2_000, repeat=10),
+    'large': dict(upload_rows=200_000, save_batches=[100, 1_000, 5_000, 20_000], query_sizes=[100, 1_000, 10_000, 50_000],
+                  groups=5_000, repeat=20),
+}
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'p50_ms': round(statistics.median(latencies) * 1000, 2),
+        'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 2),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2),
+    }
+
+
+async def timed(request):
+    start = time.perf_counter()
+    response = await request
+    elapsed = time.perf_counter() - start
+    response.raise_for_status()
+    return response, elapsed
+
+
+async def create_group(client, name):
+    response = await client.post('/groups/', json={'name': name, 'person1': 'alex', 'person2': 'sam'})
+    response.raise_for_status()
+    return response.json()['id']
+
+
+async def upload(client, group_id, name, body, owner='alex'):
+    # Seconds from the POST until the ingest job is done, and the job
+    start = time.perf_counter()
+    response = await client.post(f'/groups/{group_id}/upload', data={'owner': owner}, files={'file': (name, body)})
+    response.raise_for_status()
+    job = response.json()
+    while job['status'] not in ('done', 'failed'):
+        await asyncio.sleep(0.01)
+        job = (await client.get(f"/jobs/{job['id']}")).json()
+    if job['status'] == 'failed':
+        raise RuntimeError(f"Upload of {name} failed: {job['error']}")
+    return time.perf_counter() - start, job
+
+
+async def upload_throughput(client, params):
+    # Untimed first upload so lazy imports (pandas) are not billed to a bank
+    await upload(client, await create_group(client, 'upload warm-up'), 'warm-up.csv', synthetic.make_statement('Chase', 10))
+
+    results = {}
+    for bank in synthetic.BANKS:
+        body = synthetic.make_statement(bank, params['upload_rows'], seed=bank)
+        group_id = await create_group(client, f'upload {bank}')
+        seconds, job = await upload(client, group_id, f'{bank}.csv', body)
+        results[bank] = {
+            'rows': job['rows_parsed'],
+            'bytes': len(body),
+            'seconds': round(seconds, 3),
+            'rows_per_s': round(job['rows_parsed'] / seconds),
+        }
+    return results
+
+
+async def batch_upload(client, params):
+    # Every bank's statement as separate uploads one after another, then
+    # again as one batch upload; the first batch (untimed) starts the pool
+    warm_up = await create_group(client, 'batch warm-up')
+    response = await client.post(
+        f'/groups/{warm_up}/upload/batch', data={'owner': 'alex'},
+        files=[('files', ('warm-up.csv', synthetic.make_statement('Chase', 10)))]
+    )
+    response.raise_for_status()
+
+    statements = [
+        (f'{bank}.csv', synthetic.make_statement(bank, params['upload_rows'], seed=f'batch-{bank}'))
+        for bank in synthetic.BANKS
+    ]
+    group_id = await create_group(client, 'sequential uploads')
+    start = time.perf_counter()
+    for name, body in statements:
+        await upload(client, group_id, name, body)
+    sequential = time.perf_counter() - start
+
+    group_id = await create_group(client, 'batch upload')
+    response, batch = await timed(client.post(
+        f'/groups/{group_id}/upload/batch', data={'owner': 'alex'},
+        files=[('files', statement) for statement in statements]
+    ))
+    rows = sum(job['rows_parsed'] for job in response.json())
+    return {
+        'files': len(statements),
+        'rows': rows,
+        'sequential_s': round(sequential, 3),
+        'batch_s': round(batch, 3),
+        'batch_rows_per_s': round(rows / batch),
+    }
+
+
+async def save_transactions_latency(client, params):
+    group_id = await create_group(client, 'save')
+    body = synthetic.make_statement('Chase', max(params['save_batches']), seed='save')
+    _, job = await upload(client, group_id, 'save.csv', body)
+    transactions = (await client.get(f"/files/{job['file_id']}/transactions")).json()
+
+    results = {}
+    for size in params['save_batches']:
+        latencies = []
+        for i in range(params['repeat']):
+            action = ('Split', 'Ignore')[i % 2]
+            payload = [{**t, 'action': action} for t in transactions[:size]]
+            _, elapsed = await timed(client.post(f'/groups/{group_id}/transactions', json=payload))
+            latencies.append(elapsed)
+        results[str(size)] = {**summarize(latencies), 'rows_per_s': round(size / statistics.median(latencies))}
+    return results
+
+
+async def query_actions_latency(client, params):
+    group_id = await create_group(client, 'query')
+    body = synthetic.make_statement('Chase', max(params['query_sizes']), seed='query')
+    _, job = await upload(client, group_id, 'query.csv', body)
+    known = sorted({t['description'] for t in (await client.get(f"/files/{job['file_id']}/transactions")).json()})
+
+    results = {}
+    for size in params['query_sizes']:
+        # Seen descriptions padded with ones never seen, as a new statement would be
+        descriptions = (known + [f'UNSEEN MERCHANT {i}' for i in range(size)])[:size]
+        latencies = []
+        for _ in range(params['repeat']):
+            _, elapsed = await timed(client.post(
+                '/transactions/query-actions', json={'owner': 'alex', 'descriptions': descriptions}
+            ))
+            latencies.append(elapsed)
+        results[str(size)] = {**summarize(latencies), 'known': min(size, len(known))}
+    return results
+
+
+async def group_balances_latency(client, params):
+    with SessionLocal() as db:
+        synthetic.seed_database(db, groups=params['groups'], files_per_group=2, rows_per_file=10, seed='balances')
+
+    results = {}
+    for label, invalidate in (('uncached', True), ('cached', False)):
+        latencies = []
+        for _ in range(params['repeat']):
+            if invalidate:
+                cache.clear()
+            response, elapsed = await timed(client.get('/groups/balances'))
+            latencies.append(elapsed)
+        results[label] = {**summarize(latencies), 'groups': len(response.json())}
+    return results
+
+
+async def group_summary_latency(client, params):
+    # The summary from month buckets against what the dashboard did before:
+    # downloading every transaction to add them up itself
+    group_id = await create_group(client, 'summary')
+    body = synthetic.make_statement('Chase', params['upload_rows'], seed='summary')
+    _, job = await upload(client, group_id, 'summary.csv', body)
+
+    results = {}
+    requests = (
+        ('summary', f'/groups/{group_id}/summary'),
+        ('summary_range', f'/groups/{group_id}/summary?month_from=2024-02&month_to=2024-04'),
+        ('all_transactions', f"/files/{job['file_id']}/transactions"),
+    )
+    for label, url in requests:
+        latencies = []
+        for _ in range(params['repeat']):
+            cache.clear()
+            response, elapsed = await timed(client.get(url))
+            latencies.append(elapsed)
+        results[label] = {**summarize(latencies), 'bytes': len(response.content)}
+    results['rows'] = params['upload_rows']
+    return results
+
+
+async def sync_latency(client, params):
+    # After the other member saves a few rows: refetching the group and file
+    # lists and the file's transactions, against one GET /sync for the delta
+    group_id = await create_group(client, 'sync')
+    body = synthetic.make_statement('Chase', params['upload_rows'], seed='sync')
+    _, job = await upload(client, group_id, 'sync.csv', body)
+    file_id = job['file_id']
+    transactions = (await client.get(f'/files/{file_id}/transactions')).json()
+    rev = (await client.get('/sync', params={'since': 0, 'limit': 1})).json()['rev']
+    rev = (await client.get('/sync', params={'since': rev})).json()['rev']
+
+    refetch, delta, sizes = [], [], {}
+    for i in range(params['repeat']):
+        action = ('Split', 'Ignore')[i % 2]
+        await timed(client.post(f'/groups/{group_id}/transactions', json=[{**t, 'action': action} for t in transactions[:10]]))
+        start = time.perf_counter()
+        for url in ('/groups/', f'/groups/{group_id}/files', f'/files/{file_id}/transactions'):
+            response, _ = await timed(client.get(url))
+            sizes['refetch'] = sizes.get('refetch', 0) + len(response.content)
+        refetch.append(time.perf_counter() - start)
+        response, elapsed = await timed(client.get('/sync', params={'since': rev}))
+        rev = response.json()['rev']
+        sizes['sync'] = sizes.get('sync', 0) + len(response.content)
+        delta.append(elapsed)
+    return {
+        'refetch': {**summarize(refetch), 'bytes': sizes['refetch'] // params['repeat']},
+        'sync': {**summarize(delta), 'bytes': sizes['sync'] // params['repeat']},
+        'rows': params['upload_rows'],
+    }
+
+
+SCENARIOS = {
+    'upload_throughput': upload_throughput,
+    'batch_upload': batch_upload,
+    'save_transactions': save_transactions_latency,
+    'query_actions': query_actions_latency,
+    'group_balances': group_balances_latency,
+    'group_summary': group_summary_latency,
+    'sync': sync_latency,
+}
+
+
+def metadata(scale, params):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'started': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'commit': commit or None,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'ingest_engine': ingest.INGEST_ENGINE,
+        'scale': scale,
+        'params': params,
+    }
+
+
+async def run(scale, only):
+    params = SCALES[scale]
+    results = {'meta': metadata(scale, params), 'scenarios': {}}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=None) as client:
+        for name, scenario in SCENARIOS.items():
+            if only and name not in only:
+                continue
+            print(f'== {name}', file=sys.stderr)
+            start = time.perf_counter()
+            results['scenarios'][name] = await scenario(client, params)
+            print(f'   {time.perf_counter() - start:.1f}s', file=sys.stderr)
+    return results
+
+
+def flatten(value, prefix=''):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f'{prefix}.{key}' if prefix else key)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = dict(flatten(json.load(f)['scenarios']))
+    with open(after_path) as f:
+        after = dict(flatten(json.load(f)['scenarios']))
+    width = max(map(len, after), default=0)
+    for key, new in after.items():
+        old = before.get(key)
+        change = f'{(new - old) / old * 100:+7.1f}%' if old else '       '
+        print(f'{key:<{width}}  {old if old is not None else "-":>12}  {new:>12}  {change}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    parser.add_argument('--output', help='write results here instead of stdout')
+    parser.add_argument('--only', nargs='+', choices=SCENARIOS, help='run just these scenarios')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two result files')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*(os.path.join(INVOKED_FROM, path) for path in args.compare))
+        return
+
+    results = asyncio.run(run(args.scale, args.only))
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(os.path.join(INVOKED_FROM, args.output), 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
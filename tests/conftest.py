@@ -0,0 +1,28 @@
+import os
+import tempfile
+import uuid
+
+# A throwaway database for the whole run; set before the app is imported
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+
+import pytest
+
+from app import crud, schemas
+from app.database import SessionLocal
+from app.main import app  # noqa: F401  (creates the schema)
+
+
+def make_rows(count: int, prefix: str = 'MERCHANT'):
+    # (date, description, amount) rows as a parsed statement yields them
+    return [(f'2024-01-{i % 28 + 1:02d}', f'{prefix} {i}', -float(i % 100) - (i % 3) * 0.25) for i in range(count)]
+
+
+@pytest.fixture
+def db():
+    with SessionLocal() as session:
+        yield session
+
+
+@pytest.fixture
+def group(db):
+    return crud.create_group(db, schemas.UserGroupCreate(name=f'group {uuid.uuid4().hex}', person1='a', person2='b'))
@@ -0,0 +1,86 @@
+# The crud paths behind the main endpoints, run with EXPLAIN QUERY PLAN on
+# every statement they send: none may scan one of the large tables.
+import re
+from collections import namedtuple
+
+import pytest
+from sqlalchemy import event
+
+from app import crud, merchants, schemas, sync
+from app.database import engine
+
+from .conftest import make_rows
+
+LARGE_TABLES = ('transactions', 'files', 'last_actions', 'group_balances')
+
+Seeded = namedtuple('Seeded', 'group files page')
+
+HOT_PATHS = {
+    'files by group': lambda db, s: crud.get_files_by_group_id(db, group_id=s.group.id),
+    'file by content hash': lambda db, s: crud.get_file_by_content_hash(
+        db, group_id=s.group.id, owner='a', content_hash='0' * 64
+    ),
+    'file row count': lambda db, s: crud.count_file_transactions(db, file_id=s.files[0].id),
+    'transactions by file': lambda db, s: crud.get_transactions_by_file_id(db, file_id=s.files[0].id),
+    'transactions page': lambda db, s: crud.get_transactions_page(
+        db, file_id=s.files[0].id, after_id=s.page[-1].id, limit=50
+    ),
+    'transaction batches': lambda db, s: list(crud.iter_transaction_batches(db, file_id=s.files[0].id, batch_size=100)),
+    'group export': lambda db, s: list(crud.iter_group_transaction_batches(
+        db, group_id=s.group.id, batch_size=100,
+        filters=crud.transaction_filters(date_from='2024-01-05', date_to='2024-01-20', actions=['Split'])
+    )),
+    'save transactions': lambda db, s: crud.upsert_transactions(db, [
+        schemas.TransactionCreate(
+            date=t.date, description=t.description, amount=t.amount, action='Split',
+            owner=t.owner, previous_action=t.previous_action, file_id=t.file_id
+        )
+        for t in s.page
+    ]),
+    'query actions': lambda db, s: crud.get_last_actions(db, owner='a', descriptions=[f'MERCHANT {i}' for i in range(50)]),
+    'merchant index': lambda db, s: (merchants.forget('a'), merchants.get_index(db, 'a')),
+    'member totals': lambda db, s: crud.get_member_totals(db, group_id=s.group.id),
+    'month totals': lambda db, s: crud.get_month_totals(db, group_id=s.group.id, month_from='2024-01', month_to='2024-03'),
+    'sync changes': lambda db, s: sync.changes(db, since=1, limit=100),
+    'sync page': lambda db, s: sync.changes(db, since=2, after_id=s.page[-1].id, limit=100),
+    'search ranked': lambda db, s: crud.search_transactions(db, 'merchant 1', group_id=s.group.id, owner='a', limit=50),
+    'search recent': lambda db, s: crud.search_transactions(
+        db, 'merchant', order='recent', after_id=s.page[-1].id, limit=50
+    ),
+    'group balance': lambda db, s: crud.get_group_balances(db, group_id=s.group.id),
+    'delete file': lambda db, s: crud.delete_file(db, crud.get_file(db, s.files[-1].id)),
+}
+
+
+@pytest.fixture
+def seeded(db, group):
+    rows = [(date, f'MERCHANT {i % 50}', amount) for i, (date, _, amount) in enumerate(make_rows(500))]
+    files = [
+        crud.create_file_with_transactions(db, schemas.FileCreate(name=f'{n}.csv', group_id=group.id, owner='a'), rows)
+        for n in range(3)
+    ]
+    return Seeded(group, files, crud.get_transactions_page(db, file_id=files[0].id, limit=50))
+
+
+@pytest.mark.parametrize('name', HOT_PATHS)
+def test_hot_path_uses_indexes(db, seeded, name):
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        captured.append((statement, parameters[0] if executemany else parameters))
+
+    event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        HOT_PATHS[name](db, seeded)
+    finally:
+        event.remove(engine, 'before_cursor_execute', capture)
+
+    scans = []
+    with engine.connect() as connection:
+        for statement, parameters in captured:
+            if not re.match(r'\s*(SELECT|UPDATE|DELETE|WITH|INSERT .* SELECT)', statement, re.I | re.S):
+                continue
+            plan = [row[-1] for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters)]
+            if any(re.match(rf'SCAN ({"|".join(LARGE_TABLES)})\b(?!.*USING)', step) for step in plan):
+                scans.append((' '.join(statement.split()), plan))
+    assert not scans
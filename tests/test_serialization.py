@@ -0,0 +1,66 @@
+# The fast serialization path of the list endpoints must serve byte for byte
+# what response_model validation of the ORM objects produces.
+from typing import List
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import cache, crud, schemas
+from app.main import app
+
+from .conftest import make_rows
+
+PAGE = 7
+
+# url, the body response_model validation gives, whether a next cursor is expected.
+# `after_id` is the last id of the first page.
+CASES = {
+    'all transactions': (
+        '/files/{file_id}/transactions',
+        lambda db, group, db_file, after_id: cache.encode(
+            List[schemas.Transaction], crud.get_transactions_by_file_id(db, file_id=db_file.id)
+        ),
+        False,
+    ),
+    'first page': (
+        f'/files/{{file_id}}/transactions?limit={PAGE}',
+        lambda db, group, db_file, after_id: cache.encode(
+            List[schemas.Transaction], crud.get_transactions_page(db, file_id=db_file.id, limit=PAGE)
+        ),
+        True,
+    ),
+    'last page': (
+        '/files/{file_id}/transactions?after_id={after_id}&limit=5000',
+        lambda db, group, db_file, after_id: cache.encode(
+            List[schemas.Transaction], crud.get_transactions_page(db, file_id=db_file.id, after_id=after_id, limit=5000)
+        ),
+        False,
+    ),
+    'group files': (
+        '/groups/{group_id}/files',
+        lambda db, group, db_file, after_id: cache.encode(
+            List[schemas.File], crud.get_files_by_group_id(db, group_id=group.id)
+        ),
+        False,
+    ),
+}
+
+
+@pytest.fixture
+def golden_file(db, group):
+    # Whole and fractional amounts, since the Integer amount column stores
+    # whole ones as ints; non-ASCII text and quotes to cover escaping
+    rows = [(date, f'{description} café "{i}"', amount) for i, (date, description, amount) in enumerate(make_rows(200))]
+    return crud.create_file_with_transactions(
+        db, schemas.FileCreate(name='golden.csv', group_id=group.id, owner='a'), rows
+    )
+
+
+@pytest.mark.parametrize('name', CASES)
+def test_fast_path_matches_response_model(db, group, golden_file, name):
+    url, expected, paged = CASES[name]
+    after_id = crud.get_transactions_page(db, file_id=golden_file.id, limit=PAGE)[-1].id
+    with TestClient(app) as client:
+        response = client.get(url.format(file_id=golden_file.id, group_id=group.id, after_id=after_id))
+    assert response.content == expected(db, group, golden_file, after_id)
+    assert response.headers.get('x-next-cursor') == (str(after_id) if paged else None)
@@ -0,0 +1,73 @@
+import pytest
+from sqlalchemy import event, update
+
+from app import crud, models, schemas
+from app.database import engine
+
+from .conftest import make_rows
+
+
+@pytest.fixture
+def statements():
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        captured.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', capture)
+    yield captured
+    event.remove(engine, 'before_cursor_execute', capture)
+
+
+def save(db, group, size: int):
+    # A reviewed statement as the client saves it: every uploaded row with
+    # an action, plus as many rows entered by hand
+    db_file = crud.create_file_with_transactions(
+        db, schemas.FileCreate(name=f'{size}.csv', group_id=group.id, owner='a'), make_rows(size)
+    )
+    reviewed = [
+        schemas.TransactionCreate(
+            date=date, description=description, amount=amount, action='Split',
+            owner='a', previous_action='Ignore', file_id=db_file.id
+        )
+        for date, description, amount in make_rows(size)
+    ]
+    added = [
+        schemas.TransactionCreate(
+            date=date, description=description, amount=amount, action='b',
+            owner='a', previous_action='', file_id=db_file.id
+        )
+        for date, description, amount in make_rows(size, prefix='CASH')
+    ]
+    return reviewed + added
+
+
+def test_statement_count_does_not_grow_with_batch_size(db, group, statements):
+    counts = []
+    for size in (10, 500):
+        batch = save(db, group, size)
+        statements.clear()
+        crud.upsert_transactions(db, batch)
+        counts.append(len(statements))
+    assert counts[0] == counts[1], statements
+
+
+def test_saved_rows_come_back_with_their_ids(db, group):
+    batch = save(db, group, 50)
+    processed = crud.upsert_transactions(db, batch)
+
+    assert len({row['id'] for row in processed}) == len(batch)
+    for row in processed:
+        stored = db.get(models.Transaction, row['id'])
+        assert (stored.description, stored.action) == (row['description'], row['action'])
+
+
+def test_updated_rows_keep_their_suggested_action(db, group):
+    batch = save(db, group, 20)
+    file_id = batch[0].file_id
+    db.execute(update(models.Transaction).where(models.Transaction.file_id == file_id).values(suggested_action='b'))
+    db.commit()
+    processed = crud.upsert_transactions(db, batch)
+
+    assert {row['suggested_action'] for row in processed[:20]} == {'b'}
+    assert {row['suggested_action'] for row in processed[20:]} == {None}